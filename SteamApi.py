@@ -2,9 +2,12 @@ from BeautifulSoup import BeautifulSoup
 from BeautifulSoup import NavigableString
 from soupselect import select
 
+import gzip
+import logging
+import os
 import re
+import time
 import urllib
-import logging
 
 class Game(object):
     def __init__(self, id='0', name='', price=0.0, metascore=None):
@@ -30,13 +33,110 @@ def search_result_url(page=1):
     return 'http://store.steampowered.com/search/?sort_by=Name&sort_order=ASC&category1=998&page=%d&cc=us' % page
 
 
+class LiveFetcher(object):
+    """Fetches search result pages from the store."""
+
+    def fetch(self, page=1):
+        return urllib.urlopen(search_result_url(page)).read()
+
+
+class RecordingFetcher(LiveFetcher):
+    """
+    Fetches pages from the store, and archives a gzipped copy of each one
+    under archive_dir/<page>/<timestamp>.html.gz.
+    """
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+
+    def fetch(self, page=1):
+        html = super(RecordingFetcher, self).fetch(page)
+        page_dir = os.path.join(self.archive_dir, str(page))
+        if not os.path.isdir(page_dir):
+            os.makedirs(page_dir)
+        path = os.path.join(page_dir, '%d.html.gz' % time.time())
+        f = gzip.open(path, 'wb')
+        try:
+            f.write(html)
+        finally:
+            f.close()
+        return html
+
+
+class ReplayFetcher(object):
+    """
+    Serves pages archived by RecordingFetcher instead of hitting the store.
+    Picks the newest copy of each page, or the newest one recorded at or
+    before as_of if given, so an old crawl can be reproduced exactly.
+    """
+
+    def __init__(self, archive_dir, as_of=None):
+        self.archive_dir = archive_dir
+        self.as_of = as_of
+
+    def archived_path(self, page):
+        page_dir = os.path.join(self.archive_dir, str(page))
+        if not os.path.isdir(page_dir):
+            return None
+        timestamps = [int(name.split('.')[0]) for name in os.listdir(page_dir)
+                      if name.endswith('.html.gz')]
+        if self.as_of is not None:
+            timestamps = [t for t in timestamps if t <= self.as_of]
+        if not timestamps:
+            return None
+        return os.path.join(page_dir, '%d.html.gz' % max(timestamps))
+
+    def fetch(self, page=1):
+        path = self.archived_path(page)
+        if path is None:
+            raise IOError('No archived copy of page %d in %s' %
+                          (page, self.archive_dir))
+        f = gzip.open(path, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def pages(self):
+        """Returns the archived page numbers, in order."""
+        return sorted(int(name) for name in os.listdir(self.archive_dir)
+                      if name.isdigit() and self.archived_path(int(name)))
+
+
+def fetcher_from_environ(environ=os.environ):
+    """
+    Builds the fetcher selected by STEAM_FETCH_MODE (live, record or replay)
+    and STEAM_ARCHIVE_DIR.
+    """
+    mode = environ.get('STEAM_FETCH_MODE', 'live')
+    if mode == 'live':
+        return LiveFetcher()
+    archive_dir = environ.get('STEAM_ARCHIVE_DIR', 'archive')
+    if mode == 'record':
+        return RecordingFetcher(archive_dir)
+    elif mode == 'replay':
+        return ReplayFetcher(archive_dir)
+    raise ValueError('Unknown STEAM_FETCH_MODE %r' % mode)
+
+
+fetcher = fetcher_from_environ()
+
+
 def get_number_of_pages():
-    soup = BeautifulSoup(urllib.urlopen(search_result_url()))
+    return parse_number_of_pages(fetcher.fetch(1))
+
+
+def parse_number_of_pages(html):
+    soup = BeautifulSoup(html)
     pagination = select(soup, 'div.search_pagination_right a')
     return int(pagination[-2].string)
 
 
 def get_games(page=1):
+    return parse_games(fetcher.fetch(page))
+
+
+def parse_games(html):
     def select_first(soup, selector):
         result = select(soup, selector)
         if result and len(result) > 0:
@@ -54,7 +154,7 @@ def get_games(page=1):
 
     result = []
 
-    soup = BeautifulSoup(urllib.urlopen(search_result_url(page)))
+    soup = BeautifulSoup(html)
     games = select(soup, 'a.search_result_row')
     for game in games:
         href = str(game['href'])
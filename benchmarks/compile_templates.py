@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+'''
+Measures how long the app's templates take to compile, as every new instance
+and every dev server reload does for those without a precompiled module.
+
+Each template under templates/ is timed through the lexer alone, and through
+the whole compile: lexing, generating its module's source and compiling that.
+'large' is all of them, one after the other, repeated --copies times, which
+is lexed only.
+
+To compare against another version of mako, run this with --json there and
+with --baseline here:
+
+  python -m benchmarks.compile_templates [--repeat=N] [--copies=N]
+      [--json=OUT] [--baseline=IN]
+'''
+
+import gc
+import json
+import optparse
+import sys
+import time
+
+from mako.lexer import Lexer
+from mako.template import Template
+from templates import compiler
+
+DEFAULT_REPEAT = 50
+DEFAULT_COPIES = 20
+
+
+def _time(func, repeat):
+    best = None
+    for unused in xrange(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.time()
+            func()
+            elapsed = time.time() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def load_templates(directories=('templates',)):
+    '''Returns [(uri, source)] for every template, as unicode.'''
+    lookup = compiler.PrecompiledTemplateLookup(directories=list(directories))
+    return [(uri, open(filename).read().decode('utf-8'))
+            for uri, filename in lookup.iter_templates()]
+
+
+def measure(name, func, source, repeat=DEFAULT_REPEAT):
+    seconds = _time(func, repeat)
+    return {
+        'name': name,
+        'chars': len(source),
+        'seconds': seconds,
+        'chars_per_sec': len(source) / seconds if seconds else float('inf'),
+    }
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--repeat', type='int', default=DEFAULT_REPEAT)
+    parser.add_option('--copies', type='int', default=DEFAULT_COPIES)
+    parser.add_option('--json', metavar='FILE', default=None,
+                      help='write results to FILE, to use as a baseline')
+    parser.add_option('--baseline', metavar='FILE', default=None,
+                      help='compare against results written by --json')
+    options, unused_args = parser.parse_args(argv[1:])
+
+    templates = load_templates()
+    runs = []
+    for uri, source in templates:
+        runs.append(('lex %s' % uri,
+                     lambda source=source: Lexer(source).parse(), source))
+        runs.append(('compile %s' % uri,
+                     lambda uri=uri, source=source: Template(source, uri=uri),
+                     source))
+    large = u'\n'.join(source for uri, source in templates) * options.copies
+    runs.append(('lex large', lambda: Lexer(large).parse(), large))
+
+    baseline = {}
+    if options.baseline:
+        baseline = dict((result['name'], result)
+                        for result in json.load(open(options.baseline)))
+    results = []
+    for name, func, source in runs:
+        result = measure(name, func, source, options.repeat)
+        results.append(result)
+        compared = ''
+        if name in baseline:
+            compared = ' (%.2fx baseline)' % (
+                result['chars_per_sec'] / baseline[name]['chars_per_sec'])
+        sys.stdout.write('%-26s %7d chars %8.2f ms%s\n' % (
+            name, result['chars'], result['seconds'] * 1000, compared))
+    if options.json:
+        json.dump(results, open(options.json, 'w'), indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
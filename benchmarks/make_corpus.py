@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+'''
+Regenerates the benchmark corpus of Steam search result pages.
+
+The pages follow the search page markup that SteamApi.parse_games targets
+(a.search_result_row rows with h4 titles, .search_price and
+.search_metascore cells, and the pagination links), filled with made up but
+deterministic titles and prices. They are laid out the way
+SteamApi.RecordingFetcher archives pages, so a recorded crawl can be dropped
+in as a corpus instead:
+
+  python -m benchmarks.make_corpus [--pages=N] [DIR]
+'''
+
+import gzip
+import optparse
+import os
+import random
+import shutil
+import sys
+
+ROWS_PER_PAGE = 25
+DEFAULT_PAGES = 12
+
+# Recorded at a fixed time so regenerating does not churn the checked in files.
+RECORDED_AT = 1350000000
+
+WORDS = [
+    'Age', 'Alien', 'Ancient', 'Arena', 'Assassin', 'Battle', 'Black',
+    'Blood', 'Castle', 'Champions', 'Chronicles', 'City', 'Civilization',
+    'Command', 'Conquest', 'Crusader', 'Dark', 'Dawn', 'Dead', 'Defense',
+    'Demon', 'Dragon', 'Dungeon', 'Empire', 'Escape', 'Fallen', 'Fantasy',
+    'Fighter', 'Fire', 'Force', 'Frontier', 'Galactic', 'Ghost', 'Glory',
+    'Hero', 'Heroes', 'Hunter', 'Island', 'Journey', 'King', 'Kingdom',
+    'Knight', 'Legend', 'Legends', 'Light', 'Lost', 'Machine', 'Magic',
+    'Master', 'Mercenary', 'Might', 'Mystery', 'Night', 'Ninja', 'Ocean',
+    'Odyssey', 'Operation', 'Orcs', 'Pirates', 'Planet', 'Quest', 'Racing',
+    'Raiders', 'Realms', 'Rebellion', 'Revenge', 'Rising', 'Rogue', 'Runner',
+    'Shadow', 'Shadows', 'Simulator', 'Sky', 'Soldier', 'Space', 'Star',
+    'Storm', 'Strike', 'Super', 'Survival', 'Sword', 'Tactics', 'Tales',
+    'Thunder', 'Titan', 'Tower', 'Trials', 'Tycoon', 'Underworld', 'Vampire',
+    'Warfare', 'Warriors', 'Wasteland', 'Wings', 'Wizard', 'World', 'Zombie',
+    'Zombies']
+
+GENRES = ['Action', 'Adventure', 'Casual', 'Indie', 'RPG', 'Racing',
+          'Simulation', 'Sports', 'Strategy']
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep',
+          'Oct', 'Nov', 'Dec']
+
+HEADER = '''<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+<head>
+<meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
+<title>Search</title>
+<link href="http://cdn.store.steampowered.com/public/css/styles_storev5.css?v=3441384432" rel="stylesheet" type="text/css">
+<link href="http://cdn.store.steampowered.com/public/css/styles_search.css?v=1416217522" rel="stylesheet" type="text/css">
+<script type="text/javascript" src="http://cdn.store.steampowered.com/public/javascript/prototype-1.7.js?v=.55t44gwuwgvw"></script>
+<script type="text/javascript" src="http://cdn.store.steampowered.com/public/javascript/main.js?v=1370483540"></script>
+<script type="text/javascript">
+	var g_strLanguage = 'english';
+	var g_sessionID = "NjQ0MjQ1NTk4";
+	Event.observe( document, 'dom:loaded', function() { InitSearchPage(); } );
+</script>
+</head>
+<body class="v5">
+<div id="global_header">
+	<div class="content">
+		<div class="logo"><a href="http://store.steampowered.com/"><img src="http://cdn.steamcommunity.com/public/images/header/globalheader_logo.png" width="176" height="44" border="0" alt="Link to the Steam Homepage"></a></div>
+		<div class="supernav_container">
+			<a class="menuitem supernav" href="http://store.steampowered.com/">STORE</a>
+			<a class="menuitem" href="http://steamcommunity.com/">COMMUNITY</a>
+			<a class="menuitem" href="http://store.steampowered.com/about/">ABOUT</a>
+			<a class="menuitem" href="https://support.steampowered.com/">SUPPORT</a>
+		</div>
+	</div>
+</div>
+<div id="main">
+<div id="store_header">
+	<div id="store_nav_area">
+		<div class="store_nav">
+			<a class="tab" href="http://store.steampowered.com/"><span>Home</span></a>
+			<a class="tab" href="http://store.steampowered.com/genre/Free%20to%20Play/"><span>Free to Play</span></a>
+			<a class="tab" href="http://store.steampowered.com/search/?specials=1"><span>Specials</span></a>
+			<a class="tab" href="http://store.steampowered.com/demos/"><span>Demos</span></a>
+		</div>
+		<div id="store_search">
+			<form id="searchform" name="searchform" method="get" action="http://store.steampowered.com/search/">
+				<input type="hidden" name="snr" value="1_7_7_230_12">
+				<div class="searchbox"><input id="store_nav_search_term" name="term" type="text" class="default" placeholder="search the store" size="22" autocomplete="off"></div>
+			</form>
+		</div>
+	</div>
+</div>
+<div id="search_results_filtered_warning" style="display: none;"></div>
+<div class="leftcol">
+<div id="search_result_container">
+<div class="search_results_header">
+	<div class="col search_price">Price</div>
+	<div class="col search_type">Type</div>
+	<div class="col search_metascore">Metascore</div>
+	<div class="col search_released">Released</div>
+	<div class="col search_name">Name</div>
+	<div style="clear: both;"></div>
+</div>
+<!-- List Items -->
+'''
+
+ROW = '''<a href="http://store.steampowered.com/app/%(id)s/?snr=1_7_7_230_150_%(page)d" class="search_result_row %(parity)s" >
+	<div class="col search_price">%(price)s</div>
+	<div class="col search_type"><img src="http://cdn.store.steampowered.com/public/images/ico/ico_type_app.gif"></div>
+	<div class="col search_metascore">%(metascore)s</div>
+	<div class="col search_released">%(released)s</div>
+	<div class="col search_capsule"><img src="http://cdn.steampowered.com/v/gfx/apps/%(id)s/capsule_sm_120.jpg?t=1349993440" alt="Buy %(name)s" width="120" height="45"></div>
+	<div class="col search_name ellipsis">
+		<h4>%(name)s</h4>
+		<p><img class="platform_img" src="http://cdn.store.steampowered.com/public/images/v5/platforms/platform_win.png" width="22" height="22"> - %(genres)s - Released: %(released)s</p>
+	</div>
+	<div style="clear: both;"></div>
+</a>
+'''
+
+FOOTER = '''<!-- End List Items -->
+<div class="search_pagination">
+	<div class="search_pagination_left">showing %(first)d - %(last)d of %(total)d</div>
+	<div class="search_pagination_right">
+		%(links)s
+	</div>
+	<div style="clear: left;"></div>
+</div>
+</div>
+</div>
+<div id="footer">
+	<div class="footer_content">
+		<div class="rule"></div>
+		<div id="footer_logo"><img src="http://cdn.store.steampowered.com/public/images/v5/logo_valve_footer.jpg" width="96" height="26" border="0" alt="Valve Logo"></div>
+		<div id="footer_text">&copy; 2012 Valve Corporation. All rights reserved. All trademarks are property of their respective owners in the US and other countries.</div>
+	</div>
+</div>
+</div>
+</body>
+</html>
+'''
+
+
+def _price(rng):
+    roll = rng.random()
+    if roll < 0.08:
+        return 'Free to Play'
+    if roll < 0.12:
+        return ''
+    price = rng.choice([0.99, 2.99, 4.99, 9.99, 14.99, 19.99, 29.99, 49.99])
+    if roll < 0.3:
+        sale = round(price * rng.choice([0.25, 0.5, 0.75]), 2)
+        return ('<span style="color: #888888;"><strike>&#36;%.2f</strike>'
+                '</span><br>&#36;%.2f' % (price, sale))
+    return '&#36;%.2f' % price
+
+
+def _name(rng):
+    words = rng.sample(WORDS, rng.choice([1, 2, 2, 3, 3, 4]))
+    name = ' '.join(words)
+    roll = rng.random()
+    if roll < 0.15:
+        name += ' %d' % rng.randint(2, 4)
+    elif roll < 0.3:
+        name = '%s: %s' % (name, ' '.join(rng.sample(WORDS, 2)))
+    elif roll < 0.35:
+        name = 'The ' + name
+    elif roll < 0.4:
+        name += ' - Soundtrack'
+    return name.replace('&', '&amp;')
+
+
+def _links(page, pages):
+    links = []
+    if page > 1:
+        links.append('<a href="?sort_by=Name&amp;sort_order=ASC&amp;'
+                     'category1=998&amp;page=%d" onclick="SearchLinkClick( '
+                     'this ); return false;">&lt;</a>' % (page - 1))
+    for p in sorted(set([1, 2, 3, page, pages])):
+        if p == page:
+            links.append('<span class="pagebtn">%d</span>' % p)
+        else:
+            links.append('<a href="?sort_by=Name&amp;sort_order=ASC&amp;'
+                         'category1=998&amp;page=%d" onclick="SearchLinkClick('
+                         ' this ); return false;">%d</a>' % (p, p))
+    links.append('<a href="?sort_by=Name&amp;sort_order=ASC&amp;'
+                 'category1=998&amp;page=%d" onclick="SearchLinkClick( this );'
+                 ' return false;">&gt;</a>' % min(page + 1, pages))
+    return '\n\t\t'.join(links)
+
+
+def make_page(page, pages, rng):
+    rows = []
+    for i in xrange(ROWS_PER_PAGE):
+        metascore = ''
+        if rng.random() < 0.4:
+            metascore = str(rng.randint(40, 96))
+        rows.append(ROW % {
+            'id': 1000 + (page - 1) * ROWS_PER_PAGE * 10 + i * 10,
+            'page': i + 1,
+            'parity': 'even' if i % 2 == 0 else 'odd',
+            'price': _price(rng),
+            'metascore': metascore,
+            'released': '%s %d, %d' % (rng.choice(MONTHS), rng.randint(1, 28),
+                                       rng.randint(2004, 2012)),
+            'name': _name(rng),
+            'genres': ', '.join(rng.sample(GENRES, rng.randint(1, 3))),
+        })
+    total = pages * ROWS_PER_PAGE
+    first = (page - 1) * ROWS_PER_PAGE + 1
+    return HEADER + ''.join(rows) + FOOTER % {
+        'first': first, 'last': first + ROWS_PER_PAGE - 1, 'total': total,
+        'links': _links(page, pages)}
+
+
+def make_corpus(corpus_dir, pages=DEFAULT_PAGES):
+    rng = random.Random(1350000000)
+    if os.path.isdir(corpus_dir):
+        shutil.rmtree(corpus_dir)
+    for page in xrange(1, pages + 1):
+        page_dir = os.path.join(corpus_dir, str(page))
+        os.makedirs(page_dir)
+        path = os.path.join(page_dir, '%d.html.gz' % RECORDED_AT)
+        # A fixed mtime keeps the gzip header, and so the file, reproducible.
+        f = gzip.GzipFile(path, 'wb', mtime=RECORDED_AT)
+        try:
+            f.write(make_page(page, pages, rng))
+        finally:
+            f.close()
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options] [DIR]')
+    parser.add_option('--pages', type='int', default=DEFAULT_PAGES)
+    options, args = parser.parse_args(argv[1:])
+    corpus_dir = args[0] if args else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'corpus')
+    make_corpus(corpus_dir, pages=options.pages)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+'''
+Measures how fast the index page renders, and what escaping costs.
+
+The page lists every game in a corpus laid out the way
+SteamApi.RecordingFetcher archives pages (benchmarks/corpus by default), so
+each render escapes a few hundred titles, image URLs and links. Cached defs
+are turned off, so every row is rendered every time. The page is rendered
+with each set of default filters:
+
+  unicode  no escaping, as the app rendered before
+  legacy   mako's legacy_html_escape, a regex callback per character
+  h        filters.html_escape, what the app renders with
+
+Rendering a row is dominated by building its sparkline URL, so alongside
+the whole page this times the escape function alone over every value the
+page passes through its filters.
+
+  python -m benchmarks.render [--repeat=N] [--json=OUT] [--baseline=IN]
+'''
+
+import gc
+import json
+import optparse
+import os
+import sys
+import time
+
+os.environ.setdefault('STORAGE_BACKEND', 'local')
+
+from mako import filters
+from mako.lookup import TemplateLookup
+import models
+import SteamApi
+from benchmarks import scraper
+from templates import helpers
+
+DEFAULT_REPEAT = 20
+
+# name -> (default_filters, escape function)
+FILTERS = [
+    ('unicode', ['unicode'], None),
+    ('legacy', ['unicode', 'filters.legacy_html_escape'],
+     filters.legacy_html_escape),
+    ('h', ['h'], filters.html_escape),
+]
+
+# Values the index page writes through its default filters, see record().
+_recorded = []
+
+
+def record(value):
+    _recorded.append(value)
+    return value
+
+
+class Handler(object):
+    '''Stands in for the IndexHandler the template reads from as c.'''
+
+    def __init__(self, games):
+        self.games = games
+        self.page = 1
+        self.query = None
+
+
+def load_games(corpus_dir=scraper.DEFAULT_CORPUS):
+    games = []
+    for html in scraper.load_corpus(corpus_dir):
+        for game in SteamApi.parse_games(html):
+            game_model = models.SteamGame(
+                key_name=models.SteamGame.get_key_name(game.id),
+                steam_id=game.id, name=game.name)
+            game_model.current_price = game.price
+            games.append(game_model)
+    return games
+
+
+def _time(func, repeat):
+    best = None
+    for unused in xrange(repeat):
+        # Collect between runs rather than whenever the last one left off.
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.time()
+            func()
+            elapsed = time.time() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _render_index(default_filters, games, imports=None):
+    lookup = TemplateLookup(directories=['templates'],
+                            default_filters=default_filters,
+                            imports=imports, cache_enabled=False)
+    template = lookup.get_template('/index.mako.html')
+    c = Handler(games)
+    return lambda: template.render_unicode(h=helpers, c=c)
+
+
+def record_values(games):
+    """Returns the values the index page escapes, as unicode."""
+    # The template imports record() by module name, which under -m is a
+    # different copy of this module than __main__.
+    from benchmarks import render
+    del render._recorded[:]
+    _render_index(['unicode', 'record'], games,
+                  imports=['from benchmarks.render import record'])()
+    return list(render._recorded)
+
+
+def measure(name, default_filters, escape, games, values,
+            repeat=DEFAULT_REPEAT):
+    seconds = _time(_render_index(default_filters, games), repeat)
+    escape_seconds = 0.0
+    if escape is not None:
+        escape_seconds = _time(lambda: map(escape, values), repeat)
+    return {
+        'name': name,
+        'rows': len(games),
+        'values': len(values),
+        'seconds': seconds,
+        'escape_seconds': escape_seconds,
+        'pages_per_sec': 1 / seconds if seconds else float('inf'),
+    }
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options] [FILTERS...]')
+    parser.add_option('--corpus', default=scraper.DEFAULT_CORPUS)
+    parser.add_option('--repeat', type='int', default=DEFAULT_REPEAT)
+    parser.add_option('--json', metavar='FILE', default=None,
+                      help='write results to FILE, to use as a baseline')
+    parser.add_option('--baseline', metavar='FILE', default=None,
+                      help='compare against results written by --json')
+    options, names = parser.parse_args(argv[1:])
+
+    games = load_games(options.corpus)
+    if not games:
+        parser.error('No titles found in %s' % options.corpus)
+
+    baseline = {}
+    if options.baseline:
+        baseline = dict((result['name'], result)
+                        for result in json.load(open(options.baseline)))
+    values = record_values(games)
+    results = []
+    sys.stdout.write('%d rows, %d escaped values per page\n' % (
+        len(games), len(values)))
+    for name, default_filters, escape in FILTERS:
+        if names and name not in names:
+            continue
+        result = measure(name, default_filters, escape, games, values,
+                         options.repeat)
+        results.append(result)
+        compared = ''
+        if name in baseline:
+            compared = ' (%.2fx baseline)' % (
+                result['pages_per_sec'] / baseline[name]['pages_per_sec'])
+        sys.stdout.write('%-8s %7.2f ms/page %6.2f ms escaping%s\n' % (
+            name, result['seconds'] * 1000, result['escape_seconds'] * 1000,
+            compared))
+    if options.json:
+        json.dump(results, open(options.json, 'w'), indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
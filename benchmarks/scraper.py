@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+'''
+Measures how fast we turn Steam search pages into Game rows.
+
+Runs each benchmark over every page of a corpus laid out the way
+SteamApi.RecordingFetcher archives pages (benchmarks/corpus by default):
+
+  soup         BeautifulSoup construction
+  select       soupselect.select over prebuilt soups, with the same
+               selectors parse_games uses
+  parse_games  the whole SteamApi.parse_games path
+
+and reports pages/sec and rows/sec (best of --repeat runs), peak memory and
+the gc-tracked objects each page's result still holds on to (temporaries
+freed along the way are not counted). Each benchmark runs in a forked child
+where possible, so peak memory is not polluted by the previous benchmark.
+
+  python -m benchmarks.scraper [--repeat=N] [--json=OUT] [--baseline=IN]
+'''
+
+import gc
+import json
+import optparse
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from BeautifulSoup import BeautifulSoup
+from soupselect import select
+import SteamApi
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'corpus')
+DEFAULT_REPEAT = 5
+
+
+def load_corpus(corpus_dir=DEFAULT_CORPUS):
+    fetcher = SteamApi.ReplayFetcher(corpus_dir)
+    return [fetcher.fetch(page) for page in fetcher.pages()]
+
+
+def _soup(pages):
+    return pages, BeautifulSoup
+
+
+def _select(pages):
+    def run(soup):
+        rows = select(soup, 'a.search_result_row')
+        for row in rows:
+            select(row, 'h4')
+            select(row, '.search_price')
+            select(row, '.search_metascore')
+        return rows
+    return [BeautifulSoup(html) for html in pages], run
+
+
+def _parse_games(pages):
+    return pages, SteamApi.parse_games
+
+
+# name -> setup(pages) returning (inputs, run(input))
+BENCHMARKS = [
+    ('soup', _soup),
+    ('select', _select),
+    ('parse_games', _parse_games),
+]
+
+
+def _max_rss_kb():
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes.
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return rss
+
+
+def _retained_objects_per_input(inputs, run):
+    '''
+    Counts gc-tracked objects that are alive once run(input) has returned,
+    its result included, with the collector off so cyclic garbage like a
+    discarded soup tree is still counted. Objects freed by refcounting
+    before run returns are not; this is what a page's result keeps, not
+    everything allocated to build it.
+    '''
+    gc.collect()
+    gc.disable()
+    try:
+        total = 0
+        for item in inputs:
+            before = len(gc.get_objects())
+            result = run(item)
+            total += len(gc.get_objects()) - before
+            del result
+    finally:
+        gc.enable()
+        gc.collect()
+    return float(total) / len(inputs)
+
+
+def measure(name, setup, pages, rows_per_page, repeat=DEFAULT_REPEAT):
+    inputs, run = setup(pages)
+    rss_before = _max_rss_kb()
+    if tracemalloc is not None:
+        tracemalloc.start()
+
+    best = None
+    for unused in xrange(repeat):
+        start = time.time()
+        for item in inputs:
+            run(item)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    if tracemalloc is not None:
+        peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+    else:
+        peak_kb = _max_rss_kb() - rss_before
+    pages_per_sec = len(inputs) / best if best else float('inf')
+    return {
+        'name': name,
+        'pages': len(inputs),
+        'seconds': best,
+        'pages_per_sec': pages_per_sec,
+        'rows_per_sec': pages_per_sec * rows_per_page,
+        'peak_kb': peak_kb,
+        'retained_objects_per_page': _retained_objects_per_input(inputs, run),
+    }
+
+
+def measure_isolated(name, setup, pages, rows_per_page, repeat):
+    '''Runs measure() in a forked child, if this platform can fork.'''
+    if not hasattr(os, 'fork'):
+        return measure(name, setup, pages, rows_per_page, repeat)
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            result = measure(name, setup, pages, rows_per_page, repeat)
+            os.write(write_fd, json.dumps(result))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    chunks = []
+    while True:
+        chunk = os.read(read_fd, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    if not chunks:
+        raise RuntimeError('Benchmark %s failed' % name)
+    return json.loads(''.join(chunks))
+
+
+def report(results, baseline=None, out=sys.stdout):
+    baseline = dict((r['name'], r) for r in (baseline or []))
+    out.write('%-12s %10s %10s %10s %12s %8s\n' % (
+        'benchmark', 'pages/s', 'rows/s', 'peak KiB', 'kept/page',
+        'vs base'))
+    for r in results:
+        speedup = ''
+        if r['name'] in baseline:
+            speedup = '%.2fx' % (r['pages_per_sec'] /
+                                 baseline[r['name']]['pages_per_sec'])
+        out.write('%-12s %10.1f %10.1f %10d %12.0f %8s\n' % (
+            r['name'], r['pages_per_sec'], r['rows_per_sec'], r['peak_kb'],
+            r['retained_objects_per_page'], speedup))
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options] [BENCHMARK...]')
+    parser.add_option('--corpus', default=DEFAULT_CORPUS)
+    parser.add_option('--repeat', type='int', default=DEFAULT_REPEAT)
+    parser.add_option('--json', metavar='FILE', default=None,
+                      help='write results to FILE, to use as a baseline')
+    parser.add_option('--baseline', metavar='FILE', default=None,
+                      help='compare against results written by --json')
+    options, names = parser.parse_args(argv[1:])
+
+    pages = load_corpus(options.corpus)
+    if not pages:
+        parser.error('No pages found in %s' % options.corpus)
+    rows = sum(len(SteamApi.parse_games(html)) for html in pages)
+    rows_per_page = float(rows) / len(pages)
+
+    results = []
+    for name, setup in BENCHMARKS:
+        if names and name not in names:
+            continue
+        results.append(measure_isolated(name, setup, pages, rows_per_page,
+                                        options.repeat))
+
+    baseline = None
+    if options.baseline:
+        baseline = json.load(open(options.baseline))
+    sys.stdout.write('%d pages, %d rows\n' % (len(pages), rows))
+    report(results, baseline=baseline)
+    if options.json:
+        json.dump(results, open(options.json, 'w'), indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
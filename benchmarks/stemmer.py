@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+'''
+Measures how fast the Porter2 stemmer gets through game title vocabulary.
+
+The vocabulary is every word of every title in a corpus laid out the way
+SteamApi.RecordingFetcher archives pages (benchmarks/corpus by default), in
+the order the titles appear, as unicode like the titles we index. The
+stemmer's cache is turned off, so every word goes through the algorithm.
+
+To compare against another version of the stemmer, run this with --json
+there and with --baseline here:
+
+  python -m benchmarks.stemmer [--repeat=N] [--json=OUT] [--baseline=IN]
+'''
+
+import json
+import optparse
+import os
+import re
+import sys
+import time
+
+os.environ.setdefault('STORAGE_BACKEND', 'local')
+
+import SteamApi
+from benchmarks import scraper
+from search.pyporter2 import Stemmer
+
+DEFAULT_REPEAT = 20
+
+WORD_REGEX = re.compile(r"[\w']+", re.UNICODE)
+
+
+def load_vocabulary(corpus_dir=scraper.DEFAULT_CORPUS):
+    words = []
+    for html in scraper.load_corpus(corpus_dir):
+        for game in SteamApi.parse_games(html):
+            words.extend(WORD_REGEX.findall(unicode(game.name).lower()))
+    return words
+
+
+def measure(words, repeat=DEFAULT_REPEAT):
+    stemmer = Stemmer.Stemmer('english', cache_size=0)
+    best = None
+    for unused in xrange(repeat):
+        start = time.time()
+        stemmer.stemWords(words)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        'name': 'stemWords',
+        'words': len(words),
+        'seconds': best,
+        'words_per_sec': len(words) / best if best else float('inf'),
+    }
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--corpus', default=scraper.DEFAULT_CORPUS)
+    parser.add_option('--repeat', type='int', default=DEFAULT_REPEAT)
+    parser.add_option('--json', metavar='FILE', default=None,
+                      help='write results to FILE, to use as a baseline')
+    parser.add_option('--baseline', metavar='FILE', default=None,
+                      help='compare against results written by --json')
+    options, unused_args = parser.parse_args(argv[1:])
+
+    words = load_vocabulary(options.corpus)
+    if not words:
+        parser.error('No titles found in %s' % options.corpus)
+    result = measure(words, options.repeat)
+
+    speedup = ''
+    if options.baseline:
+        baseline = json.load(open(options.baseline))
+        speedup = ' (%.2fx baseline)' % (result['words_per_sec'] /
+                                         baseline['words_per_sec'])
+    sys.stdout.write('%d words, %d distinct: %.0f words/s%s\n' % (
+        len(words), len(set(words)), result['words_per_sec'], speedup))
+    if options.json:
+        json.dump(result, open(options.json, 'w'), indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
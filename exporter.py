@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+'''
+Streams the whole SteamGame catalog out as CSV or newline delimited JSON.
+
+Entities are walked with a cursor query one batch at a time, and each batch
+is written out before the next one is fetched, so memory use is bounded by
+the batch size rather than the size of the catalog.
+
+Run against the live app through remote_api:
+
+  python exporter.py --host=steam-price-graph-hrd.appspot.com \
+      --format=ndjson --gzip --output=games.ndjson.gz
+
+That is the only way to get the whole catalog in one go with bounded memory.
+The /export/games.<format> endpoint buffers its response, as webapp2 does, so
+it serves a page of at most MAX_PAGE_SIZE games at a time (see fetch_page),
+with a Link header pointing at the next page.
+'''
+
+import csv
+import gzip
+import json
+import logging
+import optparse
+import sys
+
+import models
+import remote
+import storage
+
+DEFAULT_BATCH_SIZE = 200
+
+# Games per page of the HTTP export, by default and at most.
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 5000
+
+FORMATS = ('csv', 'ndjson')
+
+CSV_COLUMNS = ['steam_id', 'name', 'current_price', 'price_last_changed',
+               'changed_on', 'price']
+
+
+def iter_games(batch_size=DEFAULT_BATCH_SIZE):
+    '''
+    Yields every SteamGame, holding at most one batch of batch_size entities.
+    '''
+    return storage.iter_all(models.SteamGame, batch_size=batch_size)
+
+
+def fetch_page(cursor=None, limit=DEFAULT_PAGE_SIZE):
+    '''
+    Returns up to limit SteamGames from where cursor left off, and the cursor
+    for the page after them, or None if this was the last page. limit must
+    be at least 1, or no page would ever be the last.
+    '''
+    if limit < 1:
+        raise ValueError('limit must be at least 1, not %r' % limit)
+    query = models.SteamGame.all()
+    if cursor:
+        query.with_cursor(cursor)
+    game_models = query.fetch(limit)
+    next_cursor = None
+    if len(game_models) == limit:
+        next_cursor = query.cursor()
+    return game_models, next_cursor
+
+
+def _encode(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _timestamp(game_model):
+    if game_model.price_last_changed is None:
+        return None
+    return long(game_model.price_last_changed_timestamp)
+
+
+def write_csv(out, game_models):
+    '''
+    Writes one row per price change, most recent first. Games without any
+    recorded price change still get a single row with empty change columns.
+    '''
+    writer = csv.writer(out)
+    writer.writerow(CSV_COLUMNS)
+    count = 0
+    for game_model in game_models:
+        prefix = [game_model.steam_id, game_model.name,
+                  game_model.current_price, _timestamp(game_model)]
+        changes = game_model.price_change_list or [[None, None]]
+        for changed_on, price in changes:
+            writer.writerow([_encode(v) for v in prefix + [changed_on, price]])
+        count += 1
+    return count
+
+
+def write_ndjson(out, game_models):
+    '''
+    Writes one JSON object per game, carrying its full price_change_list.
+    '''
+    count = 0
+    for game_model in game_models:
+        out.write(json.dumps({
+            'steam_id': game_model.steam_id,
+            'name': game_model.name,
+            'current_price': game_model.current_price,
+            'price_last_changed': _timestamp(game_model),
+            'price_change_list': game_model.price_change_list or [],
+        }))
+        out.write('\n')
+        count += 1
+    return count
+
+
+def export(out, format='csv', compress=False, batch_size=DEFAULT_BATCH_SIZE,
+           game_models=None):
+    '''
+    Streams game_models, by default the whole catalog, to the file-like
+    object out. Returns the number of games written.
+    '''
+    if format not in FORMATS:
+        raise ValueError('Unknown export format %r' % format)
+    stream = out
+    if compress:
+        stream = gzip.GzipFile(fileobj=out, mode='wb')
+    try:
+        if game_models is None:
+            game_models = iter_games(batch_size=batch_size)
+        if format == 'csv':
+            return write_csv(stream, game_models)
+        else:
+            return write_ndjson(stream, game_models)
+    finally:
+        if compress:
+            stream.close()
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    remote.add_options(parser)
+    parser.add_option('--format', default='csv', choices=FORMATS)
+    parser.add_option('--gzip', action='store_true', default=False)
+    parser.add_option('--batch_size', type='int', default=DEFAULT_BATCH_SIZE)
+    parser.add_option('--output', default='-',
+                      help='file to write to, - for stdout')
+    options, unused_args = parser.parse_args(argv[1:])
+
+    remote.connect(options)
+
+    if options.output == '-':
+        out = sys.stdout
+    else:
+        out = open(options.output, 'wb')
+    try:
+        count = export(out, format=options.format, compress=options.gzip,
+                       batch_size=options.batch_size)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    logging.info('Exported %d games', count)
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    main(sys.argv)
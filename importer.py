@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+'''
+Backfills price histories from archives written by exporter.py.
+
+Records are grouped into batches of games; each batch is fetched with one
+batched get, merged in memory and written back with one batched put. After
+every batch the number of input records consumed is written to a checkpoint
+file, so an interrupted import can be restarted where it left off:
+
+  python importer.py --host=steam-price-graph-hrd.appspot.com \
+      --checkpoint=games.ckpt games.ndjson.gz
+'''
+
+import csv
+import gzip
+import json
+import logging
+import optparse
+import os
+import sys
+
+import models
+import remote
+from search import query_cache
+from storage import db
+
+DEFAULT_BATCH_SIZE = 100
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _decode(value):
+    return value.decode('utf-8') if value else None
+
+
+def _price(value):
+    if value in (None, ''):
+        return None
+    return float(value)
+
+
+def read_ndjson(f):
+    '''Yields (steam_id, name, price_changes) for each line of an NDJSON file.'''
+    for line in f:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        yield (str(record['steam_id']), record.get('name'),
+               record.get('price_change_list') or [])
+
+
+def read_csv(f):
+    '''Yields (steam_id, name, price_changes) for each row of a CSV file.'''
+    for row in csv.DictReader(f):
+        price_changes = []
+        if row.get('changed_on'):
+            price_changes.append([long(row['changed_on']),
+                                  _price(row.get('price'))])
+        yield row['steam_id'], _decode(row.get('name')), price_changes
+
+
+def read_records(path):
+    base = path[:-3] if path.endswith('.gz') else path
+    if base.endswith('.csv'):
+        return read_csv(_open(path))
+    return read_ndjson(_open(path))
+
+
+def read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return 0
+    f = open(path)
+    try:
+        return int(f.read().strip() or 0)
+    finally:
+        f.close()
+
+
+def write_checkpoint(path, position):
+    if not path:
+        return
+    # Write and rename so a crash never leaves a truncated checkpoint behind.
+    f = open(path + '.tmp', 'w')
+    try:
+        f.write('%d\n' % position)
+    finally:
+        f.close()
+    os.rename(path + '.tmp', path)
+
+
+def merge_batch(pending):
+    '''
+    Merges a dict of steam_id -> (name, price_changes) into the datastore.
+    Returns the number of games written.
+    '''
+    steam_ids = pending.keys()
+    game_models = models.SteamGame.get_by_key_name(
+        [models.SteamGame.get_key_name(steam_id) for steam_id in steam_ids])
+    to_write = []
+    to_index = []
+    for steam_id, game_model in zip(steam_ids, game_models):
+        name, price_changes = pending[steam_id]
+        is_new = not game_model
+        if is_new:
+            if not name:
+                logging.warning('Skipping unknown game %s without a name',
+                                steam_id)
+                continue
+            if not price_changes:
+                # The pages render every game's price and when it last
+                # changed; the next crawl adds it with both.
+                logging.warning('Skipping unknown game %s without prices',
+                                steam_id)
+                continue
+            game_model = models.SteamGame(
+                key_name=models.SteamGame.get_key_name(steam_id),
+                steam_id=steam_id, name=name)
+            to_index.append(game_model)
+        if game_model.merge_price_changes(price_changes):
+            to_write.append(game_model)
+    db.put(to_write)
+    models.SteamGame.index_entities(to_index)
+    if to_write:
+        query_cache.invalidate(models.SteamGame.kind())
+    return len(to_write)
+
+
+def import_records(records, batch_size=DEFAULT_BATCH_SIZE, start=0,
+                   checkpoint=None):
+    '''
+    Imports an iterable of (steam_id, name, price_changes) records, skipping
+    the first start records. Returns (records consumed, games written).
+    '''
+    pending = {}
+    position = 0
+    written = 0
+    for position, (steam_id, name, price_changes) in enumerate(records, 1):
+        if position <= start:
+            continue
+        if steam_id in pending:
+            pending_name, pending_changes = pending[steam_id]
+            pending_changes.extend(price_changes)
+            name = name or pending_name
+            price_changes = pending_changes
+        pending[steam_id] = (name, list(price_changes))
+        if len(pending) >= batch_size:
+            written += merge_batch(pending)
+            write_checkpoint(checkpoint, position)
+            logging.info('...%d records, %d games written', position, written)
+            pending = {}
+    if pending:
+        written += merge_batch(pending)
+    write_checkpoint(checkpoint, max(position, start))
+    return position, written
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options] FILE...')
+    remote.add_options(parser)
+    parser.add_option('--batch_size', type='int', default=DEFAULT_BATCH_SIZE)
+    parser.add_option('--checkpoint', default=None,
+                      help='file recording progress, for resuming imports')
+    options, paths = parser.parse_args(argv[1:])
+    if not paths:
+        parser.error('No input files given')
+
+    remote.connect(options)
+
+    for path in paths:
+        checkpoint = None
+        if options.checkpoint:
+            checkpoint = '%s.%s' % (options.checkpoint,
+                                    os.path.basename(path))
+        start = read_checkpoint(checkpoint)
+        if start:
+            logging.info('Resuming %s after %d records', path, start)
+        consumed, written = import_records(
+            read_records(path), batch_size=options.batch_size, start=start,
+            checkpoint=checkpoint)
+        logging.info('Imported %s: %d records, %d games written',
+                     path, consumed, written)
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    main(sys.argv)
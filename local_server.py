@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+'''
+Runs the app on a laptop against the local datastore stand-in (see storage).
+
+  python local_server.py crawl [--pages=N] [--record=DIR | --replay=DIR]
+  python local_server.py reindex
+  python local_server.py serve [--port=8080]
+
+Crawls normally hit the live store. --record archives every fetched search
+page under DIR as well, and --replay serves pages from such an archive
+instead, which makes a crawl reproducible offline (or re-derives prices from
+the raw HTML after a parser fix).
+
+Set STORAGE_LOCAL_PATH to a SQLite file to keep the crawled catalog between
+runs; otherwise everything lives in memory for the life of the process.
+'''
+
+import logging
+import optparse
+import os
+import sys
+
+os.environ.setdefault('STORAGE_BACKEND', 'local')
+
+import webapp2
+
+import main
+import SteamApi
+from storage import taskqueue
+
+
+def call(url):
+    '''Runs a single GET request through the app and returns the response.'''
+    response = webapp2.Request.blank(url).get_response(main.app)
+    if response.status_int != 200:
+        logging.error('%s returned %s', url, response.status)
+    return response
+
+
+def crawl(pages=None):
+    '''
+    Kicks off an update cycle and then runs every queued page update in
+    process, the way the updater-queue would on App Engine.
+    '''
+    del taskqueue.tasks[:]
+    call('/webhooks/update')
+    page_tasks = [t for t in taskqueue.tasks if 'update_page' in t.url]
+    other_tasks = [t for t in taskqueue.tasks if t not in page_tasks]
+    if pages is not None:
+        page_tasks = page_tasks[:pages]
+    for task in page_tasks + other_tasks:
+        logging.info('Running %s', task.url)
+        call(task.url)
+    return len(page_tasks)
+
+
+def reindex():
+    '''
+    Rewrites the search index entities of every game, running each queued
+    batch in process. Returns the number of batches.
+    '''
+    del taskqueue.tasks[:]
+    call('/webhooks/reindex')
+    batches = 1
+    while taskqueue.tasks:
+        task = taskqueue.tasks.pop(0)
+        logging.info('Running %s', task.url)
+        call(task.url)
+        batches += 1
+    return batches
+
+
+def serve(port):
+    from wsgiref.simple_server import make_server
+    server = make_server('', port, main.app)
+    logging.info('Serving on http://localhost:%d/', port)
+    server.serve_forever()
+
+
+def run(argv):
+    parser = optparse.OptionParser(usage='%prog crawl|reindex|serve [options]')
+    parser.add_option('--pages', type='int', default=None,
+                      help='only crawl the first N pages')
+    parser.add_option('--record', metavar='DIR', default=None,
+                      help='archive fetched search pages under DIR')
+    parser.add_option('--replay', metavar='DIR', default=None,
+                      help='serve search pages from the archive in DIR')
+    parser.add_option('--as_of', type='int', default=None,
+                      help='replay the newest pages recorded before this '
+                           'unix timestamp')
+    parser.add_option('--port', type='int', default=8080)
+    options, args = parser.parse_args(argv[1:])
+    if options.record and options.replay:
+        parser.error('--record and --replay are mutually exclusive')
+    if options.record:
+        SteamApi.fetcher = SteamApi.RecordingFetcher(options.record)
+    elif options.replay:
+        SteamApi.fetcher = SteamApi.ReplayFetcher(options.replay,
+                                                  as_of=options.as_of)
+    if args == ['crawl']:
+        logging.info('Crawled %d pages', crawl(pages=options.pages))
+    elif args == ['reindex']:
+        logging.info('Reindexed in %d batches', reindex())
+    elif args == ['serve']:
+        serve(options.port)
+    else:
+        parser.error('Expected one of crawl, reindex or serve')
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    run(sys.argv)
@@ -2,29 +2,71 @@
 
 import math
 import datetime
+import json
 import time
 import os
+import urllib
 
-from google.appengine.api import taskqueue
-from google.appengine.ext import db
-from google.appengine.ext.webapp import template
-from google.appengine.ext.webapp import util
-
+from storage import db
+from storage import memcache
+from storage import taskqueue
+from search import query_cache
+from templates import compiler
 from templates import helpers
-from mako.lookup import TemplateLookup
+from mako import cache
+from mako import runtime
 import GChartWrapper
+import exporter
 import models
 import SteamApi
 import webapp2
 
 
+# Cached template defs with cache_type="memcached" share storage's memcache,
+# which is App Engine's or the local stand-in.
+cache.register_backend(
+  'memcached', lambda id, **kw: cache.MemcacheBackend(id, client=memcache, **kw))
+
+# Running on App Engine proper, rather than a dev server or local_server.py.
+PRODUCTION = os.environ.get('SERVER_SOFTWARE', '').startswith(
+  'Google App Engine')
+
+# Record render time, calls and output size of every template and def, for
+# /debug/templates. Off unless PROFILE_TEMPLATES=1 is in the environment,
+# here as in app.yaml's env_variables, since it times every def call. Must
+# happen before any template is loaded.
+PROFILE_TEMPLATES = os.environ.get('PROFILE_TEMPLATES') == '1'
+if PROFILE_TEMPLATES:
+  runtime.enable_profiling()
+
+
 class RenderMako(object):
+  '''
+  Templates by basename, e.g. renderer.index for templates/index.mako.html.
+
+  With filesystem_checks off every template is loaded up front and pinned,
+  so rendering never stats a file; call reload() to pick up edits.
+  '''
   def __init__(self, *args, **kwargs):
-    self._lookup = TemplateLookup(*args, **kwargs)
+    self.lookup = compiler.PrecompiledTemplateLookup(*args, **kwargs)
+    self._templates = {}
+    if not self.lookup.filesystem_checks:
+      self.lookup.preload()
 
   def __getattr__(self, template_name):
-    template_name = '%s.mako.html' % template_name
-    return self._lookup.get_template(template_name)
+    try:
+      return self._templates[template_name]
+    except KeyError:
+      template = self.lookup.get_template('/%s.mako.html' % template_name)
+      if not self.lookup.filesystem_checks:
+        self._templates[template_name] = template
+      return template
+
+  def reload(self):
+    self._templates.clear()
+    self.lookup.reload()
+    if not self.lookup.filesystem_checks:
+      self.lookup.preload()
 
 
 class BaseHandler(webapp2.RequestHandler):
@@ -32,12 +74,15 @@ class BaseHandler(webapp2.RequestHandler):
     Yet another request handler wrapper to add the right dash of
     functionality. Sigh.
     '''
-    renderer_ = RenderMako(directories=['templates'], format_exceptions=True)
+    # Every ${} is HTML escaped; 'h' also does what the default 'unicode' did.
+    renderer_ = RenderMako(directories=['templates'], format_exceptions=True,
+                           default_filters=['h'],
+                           filesystem_checks=not PRODUCTION)
 
     def render(self, basename):
       values = {'h': helpers, 'c': self}
-      self.response.out.write(
-        getattr(BaseHandler.renderer_, basename).render_unicode(**values))
+      getattr(BaseHandler.renderer_, basename).render_stream(
+        self.response.out, **values)
 
 
 class IndexHandler(BaseHandler):
@@ -52,7 +97,8 @@ class IndexHandler(BaseHandler):
         self.query = self.request.get('q', None)
 
         if self.query:
-          self.games = models.SteamGame.search(self.query)
+          self.games = models.SteamGame.search(
+            self.query, limit=IndexHandler.PAGE_SIZE)
         else:
           self.games_query = models.SteamGame.all().order(
             '-price_last_changed')
@@ -67,6 +113,18 @@ class IndexHandler(BaseHandler):
         self.render('index')
 
 
+class AutocompleteHandler(webapp2.RequestHandler):
+    LIMIT = 10
+
+    def get(self):
+        completions = models.SteamGame.autocomplete(
+            self.request.get('q', ''), limit=AutocompleteHandler.LIMIT)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.headers['Cache-Control'] = 'public, max-age=300'
+        self.response.out.write(json.dumps(
+            [{'id': key.name(), 'name': title} for key, title in completions]))
+
+
 class GameHandler(BaseHandler):
     def head(self, *args, **kwargs):
       self.get(*args, **kwargs)
@@ -104,7 +162,73 @@ class SparklineHandler(BaseHandler):
         self.redirect(url)
 
 
+class ExportHandler(webapp2.RequestHandler):
+    '''
+    A page of the catalog export; see exporter. The response is buffered
+    whole, so rather than the entire catalog each request gets ?limit= games
+    (from 1 to exporter.MAX_PAGE_SIZE) after ?cursor=, and a Link header with
+    the URL of the next page unless it was the last.
+    '''
+    CONTENT_TYPES = {
+        'csv': 'text/csv',
+        'ndjson': 'application/x-ndjson',
+    }
+
+    def get(self, format):
+        if format not in exporter.FORMATS:
+            self.abort(404)
+        compress = bool(self.request.get('gzip'))
+        try:
+            limit = int(self.request.get('limit', exporter.DEFAULT_PAGE_SIZE))
+        except ValueError:
+            self.abort(400)  # limit is not a number
+        limit = max(1, min(limit, exporter.MAX_PAGE_SIZE))
+        game_models, next_cursor = exporter.fetch_page(
+            self.request.get('cursor', None), limit)
+
+        filename = 'games.%s' % format
+        if compress:
+            filename += '.gz'
+            self.response.headers['Content-Type'] = 'application/gzip'
+        else:
+            self.response.headers['Content-Type'] = \
+                ExportHandler.CONTENT_TYPES[format]
+        self.response.headers['Content-Disposition'] = \
+            'attachment; filename=%s' % filename
+        if next_cursor:
+            params = {'cursor': next_cursor, 'limit': limit}
+            if compress:
+                params['gzip'] = 1
+            self.response.headers['Link'] = '<%s?%s>; rel="next"' % (
+                self.request.path_url, urllib.urlencode(params))
+        exporter.export(self.response.out, format=format, compress=compress,
+                        game_models=game_models)
+
+
+class TemplateStatsHandler(webapp2.RequestHandler):
+    '''
+    Template render stats as JSON, slowest first. Each entry is a template
+    and def: def 'body' is the template's body, and null a whole render of
+    it. Times are in seconds and include the defs called. POST to reset.
+    '''
+    def get(self):
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.headers['Cache-Control'] = 'no-cache'
+        self.response.out.write(json.dumps({
+          'enabled': runtime.profiler is not None,
+          'templates': runtime.get_stats()}, indent=1))
+
+    def post(self):
+        runtime.reset_stats()
+        self.redirect('/debug/templates')
+
+
 class WebHookHandler(webapp2.RequestHandler):
+    # updater-queue runs 12 tasks a minute.
+    SECONDS_PER_PAGE = 5
+    # Games whose search index entities one reindex task rewrites.
+    REINDEX_BATCH_SIZE = 100
+
     def get(self, action):
         self.process(action)
 
@@ -118,6 +242,10 @@ class WebHookHandler(webapp2.RequestHandler):
             self.update()
         elif action == 'update_page':
             self.update_page(int(self.request.get('page')))
+        elif action == 'build_search_snapshot':
+            self.build_search_snapshot()
+        elif action == 'reindex':
+            self.reindex(self.request.get('cursor', None))
         else:
             self.abort(404)
 
@@ -137,12 +265,21 @@ class WebHookHandler(webapp2.RequestHandler):
             self.response.out.write('...page %d<br>' % page)
         self.response.out.write('Enqueued %d pages' % number_of_pages)
 
+        # Rebuild the search snapshot once the queue should have drained.
+        taskqueue.add(queue_name='updater-queue',
+                      url='/webhooks/build_search_snapshot',
+                      method='GET',
+                      target='webhook-backend',
+                      countdown=number_of_pages * WebHookHandler.SECONDS_PER_PAGE)
+
     def update_page(self, page):
         games = SteamApi.get_games(page)
         game_models = models.SteamGame.get_by_key_name(
           [models.SteamGame.get_key_name(g.id) for g in games])
         to_write = []
         to_index = []
+        # Whether any game's search result listing changed.
+        changed = False
         for game, game_model in zip(games, game_models):
             self.response.out.write('Starting: %s...' % game.name)
             game_key_name = models.SteamGame.get_key_name(game.id)
@@ -154,10 +291,13 @@ class WebHookHandler(webapp2.RequestHandler):
             else:
                 should_reindex = game_model.name != game.name
 
+            price_changes = len(game_model.price_change_list)
             game_model.steam_id = game.id
             game_model.name = game.name
             game_model.current_price = game.price
             to_write.append(game_model)
+            if len(game_model.price_change_list) != price_changes:
+                changed = True
 
             # Only reindex if the entry is new, or the name has changed.
             if should_reindex:
@@ -169,16 +309,48 @@ class WebHookHandler(webapp2.RequestHandler):
             self.response.out.write('<br>')
         self.response.out.write('Writing...')
         db.put(to_write)
-        for game_model in to_index:
-          game_model.index()
+        models.SteamGame.index_entities(to_index)
+        if changed or to_index:
+          query_cache.invalidate(models.SteamGame.kind())
         self.response.out.write('done<br>')
         self.response.out.write('<br>Done.')
         self.response.out.write('<br><a href="?page=%d">Next</a>' % (page + 1))
 
+    def reindex(self, cursor=None):
+        '''
+        Rewrites the search index entities of every game, a batch per task,
+        each task queueing the next. Run it whenever the phrases games are
+        indexed under change format, since update_page only reindexes games
+        that are new or renamed.
+        '''
+        query = models.SteamGame.all()
+        if cursor:
+          query.with_cursor(cursor)
+        games = query.fetch(WebHookHandler.REINDEX_BATCH_SIZE)
+        written = models.SteamGame.index_entities(games)
+        if written:
+          query_cache.invalidate(models.SteamGame.kind())
+        self.response.out.write('Reindexed %d of %d games' % (
+            written, len(games)))
+        if len(games) == WebHookHandler.REINDEX_BATCH_SIZE:
+          taskqueue.add(queue_name='updater-queue',
+                        url='/webhooks/reindex?' + urllib.urlencode(
+                            {'cursor': query.cursor()}),
+                        method='GET',
+                        target='webhook-backend')
+
+    def build_search_snapshot(self):
+        index = models.SteamGame.build_search_snapshot()
+        self.response.out.write('Indexed %d games, %d phrases' % (
+            len(index.titles), len(index.postings)))
+
 
 app = webapp2.WSGIApplication(
     [('/', IndexHandler),
+     ('/autocomplete', AutocompleteHandler),
      webapp2.Route('/games/<steam_id>/sparkline', SparklineHandler),
      webapp2.Route('/games/<steam_id>', GameHandler),
-     webapp2.Route('/webhooks/<action>', WebHookHandler)],
+     webapp2.Route('/export/games.<format>', ExportHandler),
+     webapp2.Route('/webhooks/<action>', WebHookHandler),
+     ('/debug/templates', TemplateStatsHandler)],
     debug=True)
@@ -1,4 +1,6 @@
-from mako import exceptions
+import hashlib, time
+
+from mako import exceptions, util
 
 try:
     from beaker import cache
@@ -6,50 +8,154 @@ try:
 except ImportError:
     cache = None
 
+class MemoryBackend(object):
+    """Caches values in-process, in a util.LRUCache of at most `capacity`
+    items per template.
+
+    Entries created before the template's module was generated
+    (`starttime`) or more than `expiretime` seconds ago are treated
+    as missing.
+    """
+
+    def __init__(self, id, capacity=1000, **kw):
+        self.id = id
+        self._values = util.LRUCache(capacity)
+
+    def get_value(self, key, starttime=None, expiretime=None, createfunc=None):
+        entry = self._values.get(key)
+        if entry is not None:
+            created, value = entry
+            if (starttime is None or created >= starttime) and \
+                    (not expiretime or time.time() - created < expiretime):
+                return value
+        if createfunc is None:
+            raise KeyError(key)
+        value = createfunc()
+        self._values[key] = (time.time(), value)
+        return value
+
+    def put_value(self, key, value, starttime=None, expiretime=None):
+        self._values[key] = (time.time(), value)
+
+    def remove_value(self, key, starttime=None, expiretime=None):
+        self._values.pop(key, None)
+
+class MemcacheBackend(object):
+    """Caches values in memcached, so that every process rendering the
+    template shares them.
+
+    `client` is any object with the get/set/delete methods of the App Engine
+    and python-memcached clients.  It defaults to App Engine's memcache, or
+    failing that a python-memcached client for the servers in `url`
+    (separated by semicolons).  Keys include `starttime`, so entries from
+    an older version of the template are never seen.
+    """
+
+    def __init__(self, id, client=None, url=None, **kw):
+        self.id = id
+        if client is None:
+            client = self._default_client(url)
+        self.client = client
+
+    def _default_client(self, url):
+        try:
+            from google.appengine.api import memcache
+            return memcache
+        except ImportError:
+            pass
+        if not url:
+            raise exceptions.RuntimeException(
+                "the memcached cache type requires a client or a url")
+        try:
+            import memcache
+        except ImportError:
+            raise exceptions.RuntimeException(
+                "the python-memcached package is required to use "
+                "the memcached cache type outside App Engine.")
+        return memcache.Client(url.split(';'))
+
+    def _key(self, key, starttime):
+        # memcached keys are limited to 250 bytes of ascii
+        return 'mako:' + hashlib.sha1(repr((self.id, starttime, key))).hexdigest()
+
+    def get_value(self, key, starttime=None, expiretime=None, createfunc=None):
+        mkey = self._key(key, starttime)
+        value = self.client.get(mkey)
+        if value is not None:
+            return value
+        if createfunc is None:
+            raise KeyError(key)
+        value = createfunc()
+        self.client.set(mkey, value, expiretime or 0)
+        return value
+
+    def put_value(self, key, value, starttime=None, expiretime=None):
+        self.client.set(self._key(key, starttime), value, expiretime or 0)
+
+    def remove_value(self, key, starttime=None, expiretime=None):
+        self.client.delete(self._key(key, starttime))
+
+# cache types served without Beaker.  Each is called with the template's
+# cache id and the remaining cache arguments (data_dir, url, etc.).
+backends = {
+    'memory':MemoryBackend,
+    'memcached':MemcacheBackend,
+}
+
+def register_backend(type, factory):
+    """Serve the given cache type from factory(id, **kw) rather than Beaker."""
+    backends[type] = factory
+
 class Cache(object):
     def __init__(self, id, starttime):
         self.id = id
         self.starttime = starttime
         self.def_regions = {}
-        
+        self._backends = {}
+
     def put(self, key, value, **kwargs):
         defname = kwargs.pop('defname', None)
         expiretime = kwargs.pop('expiretime', None)
         createfunc = kwargs.pop('createfunc', None)
-        
-        self._get_cache(defname, **kwargs).put_value(key, starttime=self.starttime, expiretime=expiretime)
-        
+
+        self._get_cache(defname, **kwargs).put_value(key, value, starttime=self.starttime, expiretime=expiretime)
+
     def get(self, key, **kwargs):
         defname = kwargs.pop('defname', None)
         expiretime = kwargs.pop('expiretime', None)
         createfunc = kwargs.pop('createfunc', None)
-        
+
         return self._get_cache(defname, **kwargs).get_value(key, starttime=self.starttime, expiretime=expiretime, createfunc=createfunc)
-        
+
     def invalidate(self, key, **kwargs):
         defname = kwargs.pop('defname', None)
         expiretime = kwargs.pop('expiretime', None)
         createfunc = kwargs.pop('createfunc', None)
-        
+
         self._get_cache(defname, **kwargs).remove_value(key, starttime=self.starttime, expiretime=expiretime)
-    
+
     def invalidate_body(self):
         self.invalidate('render_body', defname='render_body')
-    
+
     def invalidate_def(self, name):
         self.invalidate('render_%s' % name, defname='render_%s' % name)
-        
+
     def invalidate_closure(self, name):
         self.invalidate(name, defname=name)
-    
+
     def _get_cache(self, defname, type=None, **kw):
-        if not cache:
-            raise exceptions.RuntimeException("the Beaker package is required to use cache functionality.")
-        if type == 'memcached':
-            type = 'ext:memcached'
         if not type:
             (type, kw) = self.def_regions.get(defname, ('memory', {}))
         else:
             self.def_regions[defname] = (type, kw)
+        if type in backends:
+            # one backend per type and arguments, so that every def
+            # of this template sharing them shares its storage
+            regionkey = (type, tuple(sorted(kw.items())))
+            backend = self._backends.get(regionkey)
+            if backend is None:
+                backend = self._backends.setdefault(regionkey, backends[type](self.id, **kw))
+            return backend
+        if not cache:
+            raise exceptions.RuntimeException("the Beaker package is required to use cache functionality.")
         return cache.get_cache(self.id, type=type, **kw)
-        
\ No newline at end of file
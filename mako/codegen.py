@@ -36,6 +36,7 @@ def compile(node,
         
     buf = util.FastEncodingBuffer()
 
+    _coalesce_text(node)
     printer = PythonPrinter(buf)
     _GenerateRenderMethod(printer, 
                             _CompileContext(uri, 
@@ -49,6 +50,46 @@ def compile(node,
                                 node)
     return buf.getvalue()
 
+# nodes which generate no code where they appear in a render method
+_SILENT_NODES = (parsetree.Comment, parsetree.DefTag, parsetree.NamespaceTag,
+                    parsetree.InheritTag, parsetree.PageTag)
+
+def _coalesce_text(node):
+    """merge static text into the write before it, where that can't 
+    change the output, so that each render makes fewer writer calls.
+    
+    adjacent Text nodes, including those separated only by comments, 
+    defs and the like, become one.  text straight after an expression 
+    is kept as the expression's trailing_text, which visitExpression 
+    appends to the expression's filtered value.
+    
+    constant text is left where it is rather than hoisted to module level; 
+    a literal is already a constant of the code object, and loading it 
+    is cheaper than looking up a global.
+    """
+    nodes = getattr(node, 'nodes', None)
+    if not nodes:
+        return
+    merged = []
+    last = None
+    for n in nodes:
+        if isinstance(n, parsetree.Text):
+            if isinstance(last, parsetree.Text):
+                last.content += n.content
+                continue
+            elif isinstance(last, parsetree.Expression):
+                last.trailing_text = (last.trailing_text or n.content[:0]) + n.content
+                continue
+            last = n
+        elif isinstance(n, parsetree.Expression):
+            n.trailing_text = None
+            last = n
+        elif not isinstance(n, _SILENT_NODES):
+            last = None
+        merged.append(n)
+        _coalesce_text(n)
+    nodes[:] = merged
+
 class _CompileContext(object):
     def __init__(self, 
                     uri, 
@@ -627,9 +668,18 @@ class _GenerateRenderMethod(object):
                 len(self.compiler.default_filters):
                 
             s = self.create_filter_callable(node.escapes_code.args, "%s" % node.text, True)
-            self.printer.writeline("__M_writer(%s)" % s)
         else:
-            self.printer.writeline("__M_writer(%s)" % node.text)
+            s = node.text
+        text = getattr(node, 'trailing_text', None)
+        if text and s != node.text:
+            # filters return strings, so the text can go in the same 
+            # write.  any output the expression itself writes still 
+            # comes first.
+            self.printer.writeline("__M_writer(%s + %s)" % (s, repr(text)))
+        else:
+            self.printer.writeline("__M_writer(%s)" % s)
+            if text:
+                self.printer.writeline("__M_writer(%s)" % repr(text))
             
     def visitControlLine(self, node):
         if node.isend:
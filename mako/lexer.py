@@ -12,6 +12,68 @@ from mako.pygen import adjust_whitespace
 
 _regexp_cache = {}
 
+# the constructs Lexer.parse() looks for at each position, in order of 
+# precedence.  they are combined into one pattern, _token_re, of named 
+# groups, so that finding the next one takes a single match; a group's 
+# own subgroups are numbered from match.lastindex + 1.
+_tokens = [
+    ('end', r'\Z'),
+    ('expression', r'\$\{'),
+    # a % or ## at the start of a line
+    ('control_line', r'(?<=^)[\t ]*(%(?!%)|##)[\t ]*'
+                     r'((?:(?:\\r?\n)|[^\r\n])*)(?:\r?\n|\Z)'),
+    ('comment', r'<%doc>(.*?)</%doc>'),
+    # opening tag: keyword, attribute names, = signs and strings, closing
+    ('tag_start', r'\<%([\w\.\:]+)'
+                  r'((?:\s+\w+|\s*=\s*|".*?"|\'.*?\')*)'
+                  r'\s*(/)?>'),
+    ('tag_end', r'\</%[\t ]*([^\n]+?)[\t ]*>'),
+    ('python_block', r'<%(!)?'),
+    # anything, followed by: an eval or line-based comment preceded by a 
+    # consumed newline and whitespace, an expression, a multiline comment,
+    # a substitution or block or call start or end (none of which are 
+    # consumed), an escaped newline (thrown away), or the end of the string.
+    # each of those starts just after a newline, at one of $#<\ or at the
+    # end, so the text is taken in runs free of those characters rather 
+    # than a character at a time.
+    ('text', r'((?:[^\n][^\n$#<\\]*|\n)*?)'
+             r'((?<=\n)(?=[ \t]*(?=%|##))|(?=\$\{)|(?=#\*)|(?=</?[%&])'
+             r'|(\\\r?\n)|\Z)'),
+]
+
+_token_re = re.compile(
+                r'|'.join([r'(?P<%s>%s)' % token for token in _tokens]), 
+                re.S | re.M)
+
+# name="value" pairs within a tag_start's attributes
+_attribute_re = re.compile(r"\s*(\w+)\s*=\s*(?:'([^']*)'|\"([^\"]*)\")")
+
+# the keyword of a % control line
+_control_keyword_re = re.compile(r'(end)?(\w+)\s*(.*)')
+
+# the rest of a string parse_until_text() skips, by opening quote
+_string_end_res = dict([(quote, re.compile(r'.*?%s' % quote, re.S)) 
+                        for quote in ('"""', "'''", '"', "'")])
+
+_until_text_cache = {}
+
+def _until_text_re(text):
+    """return the pattern parse_until_text() steps through code with, 
+    up to one of the patterns in `text`.
+    
+    each match is a comment, an opening quote (group 1), one of the 
+    patterns (group 2), or the code up to the next of those.
+    """
+    try:
+        return _until_text_cache[text]
+    except KeyError:
+        until = r'|'.join(text)
+        reg = re.compile(
+                    r'#[^\n]*\n|(\"\"\"|\'\'\'|\"|\')|(%s)|.*?(?=\"|\'|#|%s)' % 
+                    (until, until), re.S)
+        _until_text_cache[text] = reg
+        return reg
+
 class Lexer(object):
     def __init__(self, text, filename=None, 
                         disable_unicode=False, 
@@ -70,7 +132,7 @@ class Lexer(object):
 
         mp = self.match_position
 
-        match = reg.match(self.text, self.match_position)
+        match = reg.match(self.text, mp)
         if match:
             (start, end) = match.span()
             if end == start:
@@ -78,44 +140,32 @@ class Lexer(object):
             else:
                 self.match_position = end
             self.matched_lineno = self.lineno
-            lines = re.findall(r"\n", self.text[mp:self.match_position])
-            cp = mp - 1
-            while (cp >= 0 and cp<self.textlength and self.text[cp] != '\n'):
-                cp -=1
-            self.matched_charpos = mp - cp
-            self.lineno += len(lines)
-            #print "MATCHED:", match.group(0), "LINE START:", 
-            # self.matched_lineno, "LINE END:", self.lineno
-        #print "MATCH:", regexp, "\n", self.text[mp : mp + 15], (match and "TRUE" or "FALSE")
+            self.matched_charpos = mp - self.text.rfind('\n', 0, mp)
+            self.lineno += self.text.count('\n', mp, self.match_position)
         return match
     
     def parse_until_text(self, *text):
         startpos = self.match_position
+        reg = _until_text_re(text)
         while True:
-            match = self.match(r'#.*\n')
-            if match:
-                continue
-            match = self.match(r'(\"\"\"|\'\'\'|\"|\')')
-            if match:
-                m = self.match(r'.*?%s' % match.group(1), re.S)
+            match = self.match_reg(reg)
+            if not match:
+                raise exceptions.SyntaxException(
+                            "Expected: %s" % 
+                            ','.join(text), 
+                            **self.exception_kwargs)
+            quote, end = match.group(1, 2)
+            if quote:
+                m = self.match_reg(_string_end_res[quote])
                 if not m:
                     raise exceptions.SyntaxException(
                                 "Unmatched '%s'" % 
-                                match.group(1), 
+                                quote, 
                                 **self.exception_kwargs)
-            else:
-                match = self.match(r'(%s)' % r'|'.join(text))
-                if match:
-                    return \
-                        self.text[startpos:self.match_position-len(match.group(1))],\
-                        match.group(1)
-                else:
-                    match = self.match(r".*?(?=\"|\'|#|%s)" % r'|'.join(text), re.S)
-                    if not match:
-                        raise exceptions.SyntaxException(
-                                    "Expected: %s" % 
-                                    ','.join(text), 
-                                    **self.exception_kwargs)
+            elif end:
+                return \
+                    self.text[startpos:self.match_position-len(end)],\
+                    end
                 
     def append_node(self, nodecls, *args, **kwargs):
         kwargs.setdefault('source', self.text)
@@ -199,31 +249,14 @@ class Lexer(object):
         self.match_reg(self._coding_re)
         
         self.textlength = len(self.text)
-            
-        while (True):
-            if self.match_position > self.textlength: 
-                break
         
-            if self.match_end():
-                break
-            if self.match_expression():
-                continue
-            if self.match_control_line():
-                continue
-            if self.match_comment():
-                continue
-            if self.match_tag_start(): 
-                continue
-            if self.match_tag_end():
-                continue
-            if self.match_python_block():
-                continue
-            if self.match_text(): 
-                continue
-            
-            if self.match_position > self.textlength: 
+        while self.match_position <= self.textlength:
+            match = self.match_reg(_token_re)
+            if not match:
+                raise exceptions.CompileException("assertion failed")
+            if match.lastgroup == 'end':
                 break
-            raise exceptions.CompileException("assertion failed")
+            getattr(self, 'parse_' + match.lastgroup)(match)
             
         if len(self.tag):
             raise exceptions.SyntaxException("Unclosed tag: <%%%s>" % 
@@ -237,178 +270,100 @@ class Lexer(object):
                                             self.control_line[-1].pos, self.filename)
         return self.template
 
-    def match_tag_start(self):
-        match = self.match(r'''
-            \<%     # opening tag
-            
-            ([\w\.\:]+)   # keyword
-            
-            ((?:\s+\w+|\s*=\s*|".*?"|'.*?')*)  # attrname, = sign, string expression
-            
-            \s*     # more whitespace
-            
-            (/)?>   # closing
-            
-            ''', 
-            
-            re.I | re.S | re.X)
-            
-        if match:
-            keyword, attr, isend = match.group(1), match.group(2), match.group(3)
-            self.keyword = keyword
-            attributes = {}
-            if attr:
-                for att in re.findall(r"\s*(\w+)\s*=\s*(?:'([^']*)'|\"([^\"]*)\")", attr):
-                    key, val1, val2 = att
-                    text = val1 or val2
-                    text = text.replace('\r\n', '\n')
-                    attributes[key] = text
-            self.append_node(parsetree.Tag, keyword, attributes)
-            if isend:
-                self.tag.pop()
-            else:
-                if keyword == 'text':
-                    match = self.match(r'(.*?)(?=\</%text>)',  re.S)
-                    if not match:
-                        raise exceptions.SyntaxException(
-                                            "Unclosed tag: <%%%s>" % 
-                                            self.tag[-1].keyword, 
-                                            **self.exception_kwargs)
-                    self.append_node(parsetree.Text, match.group(1))
-                    return self.match_tag_end()
-            return True
-        else: 
-            return False
-        
-    def match_tag_end(self):
-        match = self.match(r'\</%[\t ]*(.+?)[\t ]*>')
-        if match:
-            if not len(self.tag):
-                raise exceptions.SyntaxException(
-                                        "Closing tag without opening tag: </%%%s>" %
-                                        match.group(1), 
-                                        **self.exception_kwargs)
-            elif self.tag[-1].keyword != match.group(1):
-                raise exceptions.SyntaxException(
-                                        "Closing tag </%%%s> does not match tag: <%%%s>" %
-                                        (match.group(1), self.tag[-1].keyword),
-                                        **self.exception_kwargs)
+    def parse_tag_start(self, match):
+        group = match.lastindex
+        keyword, attr, isend = match.group(group + 1, group + 2, group + 3)
+        self.keyword = keyword
+        attributes = {}
+        if attr:
+            for att in _attribute_re.findall(attr):
+                key, val1, val2 = att
+                text = val1 or val2
+                text = text.replace('\r\n', '\n')
+                attributes[key] = text
+        self.append_node(parsetree.Tag, keyword, attributes)
+        if isend:
             self.tag.pop()
-            return True
-        else:
-            return False
-            
-    def match_end(self):
-        match = self.match(r'\Z', re.S)
-        if match:
-            string = match.group()
-            if string:
-                return string
-            else:
-                return True
-        else:
-            return False
-    
-    def match_text(self):
-        match = self.match(r"""
-                (.*?)         # anything, followed by:
-                (
-                 (?<=\n)(?=[ \t]*(?=%|\#\#)) # an eval or line-based 
-                                             # comment preceded by a 
-                                             # consumed newline and whitespace
-                 |
-                 (?=\${)      # an expression
-                 |
-                 (?=\#\*)     # multiline comment
-                 |
-                 (?=</?[%&])  # a substitution or block or call start or end
-                              # - don't consume
-                 |
-                 (\\\r?\n)    # an escaped newline  - throw away
-                 |
-                 \Z           # end of string
-                )""", re.X | re.S)
+        elif keyword == 'text':
+            match = self.match(r'(.*?)(?=\</%text>)',  re.S)
+            if not match:
+                raise exceptions.SyntaxException(
+                                    "Unclosed tag: <%%%s>" % 
+                                    self.tag[-1].keyword, 
+                                    **self.exception_kwargs)
+            self.append_node(parsetree.Text, match.group(1))
+            match = self.match_reg(_token_re)
+            self.parse_tag_end(match)
         
-        if match:
-            text = match.group(1)
-            self.append_node(parsetree.Text, text)
-            return True
-        else:
-            return False
+    def parse_tag_end(self, match):
+        keyword = match.group(match.lastindex + 1)
+        if not len(self.tag):
+            raise exceptions.SyntaxException(
+                                    "Closing tag without opening tag: </%%%s>" %
+                                    keyword, 
+                                    **self.exception_kwargs)
+        elif self.tag[-1].keyword != keyword:
+            raise exceptions.SyntaxException(
+                                    "Closing tag </%%%s> does not match tag: <%%%s>" %
+                                    (keyword, self.tag[-1].keyword),
+                                    **self.exception_kwargs)
+        self.tag.pop()
+            
+    def parse_text(self, match):
+        self.append_node(parsetree.Text, match.group(match.lastindex + 1))
     
-    def match_python_block(self):
-        match = self.match(r"<%(!)?")
-        if match:
-            line, pos = self.matched_lineno, self.matched_charpos
-            text, end = self.parse_until_text(r'%>')
-            # the trailing newline helps 
-            # compiler.parse() not complain about indentation
-            text = adjust_whitespace(text) + "\n"   
-            self.append_node(
-                            parsetree.Code, 
-                            text, 
-                            match.group(1)=='!', lineno=line, pos=pos)
-            return True
-        else:
-            return False
+    def parse_python_block(self, match):
+        line, pos = self.matched_lineno, self.matched_charpos
+        text, end = self.parse_until_text(r'%>')
+        # the trailing newline helps 
+        # compiler.parse() not complain about indentation
+        text = adjust_whitespace(text) + "\n"   
+        self.append_node(
+                        parsetree.Code, 
+                        text, 
+                        match.group(match.lastindex + 1)=='!', lineno=line, pos=pos)
             
-    def match_expression(self):
-        match = self.match(r"\${")
-        if match:
-            line, pos = self.matched_lineno, self.matched_charpos
-            text, end = self.parse_until_text(r'\|', r'}')
-            if end == '|':
-                escapes, end = self.parse_until_text(r'}')
-            else:
-                escapes = ""
-            text = text.replace('\r\n', '\n')
-            self.append_node(
-                            parsetree.Expression, 
-                            text, escapes.strip(), 
-                            lineno=line, pos=pos)
-            return True
+    def parse_expression(self, match):
+        line, pos = self.matched_lineno, self.matched_charpos
+        text, end = self.parse_until_text(r'\|', r'}')
+        if end == '|':
+            escapes, end = self.parse_until_text(r'}')
         else:
-            return False
+            escapes = ""
+        text = text.replace('\r\n', '\n')
+        self.append_node(
+                        parsetree.Expression, 
+                        text, escapes.strip(), 
+                        lineno=line, pos=pos)
 
-    def match_control_line(self):
-        match = self.match(r"(?<=^)[\t ]*(%(?!%)|##)[\t ]*((?:(?:\\r?\n)|[^\r\n])*)(?:\r?\n|\Z)", re.M)
-        if match:
-            operator = match.group(1)
-            text = match.group(2)
-            if operator == '%':
-                m2 = re.match(r'(end)?(\w+)\s*(.*)', text)
-                if not m2:
+    def parse_control_line(self, match):
+        group = match.lastindex
+        operator, text = match.group(group + 1, group + 2)
+        if operator == '%':
+            m2 = _control_keyword_re.match(text)
+            if not m2:
+                raise exceptions.SyntaxException(
+                            "Invalid control line: '%s'" % 
+                            text, 
+                            **self.exception_kwargs)
+            isend, keyword = m2.group(1, 2)
+            isend = (isend is not None)
+            
+            if isend:
+                if not len(self.control_line):
                     raise exceptions.SyntaxException(
-                                "Invalid control line: '%s'" % 
-                                text, 
-                                **self.exception_kwargs)
-                isend, keyword = m2.group(1, 2)
-                isend = (isend is not None)
-                
-                if isend:
-                    if not len(self.control_line):
-                        raise exceptions.SyntaxException(
-                                "No starting keyword '%s' for '%s'" % 
-                                (keyword, text), 
-                                **self.exception_kwargs)
-                    elif self.control_line[-1].keyword != keyword:
-                        raise exceptions.SyntaxException(
-                                "Keyword '%s' doesn't match keyword '%s'" % 
-                                (text, self.control_line[-1].keyword), 
-                                **self.exception_kwargs)
-                self.append_node(parsetree.ControlLine, keyword, isend, text)
-            else:
-                self.append_node(parsetree.Comment, text)
-            return True
+                            "No starting keyword '%s' for '%s'" % 
+                            (keyword, text), 
+                            **self.exception_kwargs)
+                elif self.control_line[-1].keyword != keyword:
+                    raise exceptions.SyntaxException(
+                            "Keyword '%s' doesn't match keyword '%s'" % 
+                            (text, self.control_line[-1].keyword), 
+                            **self.exception_kwargs)
+            self.append_node(parsetree.ControlLine, keyword, isend, text)
         else:
-            return False
+            self.append_node(parsetree.Comment, text)
 
-    def match_comment(self):
-        """matches the multiline version of a comment"""
-        match = self.match(r"<%doc>(.*?)</%doc>", re.S)
-        if match:
-            self.append_node(parsetree.Comment, match.group(1))
-            return True
-        else:
-            return False
-             
+    def parse_comment(self, match):
+        """the multiline version of a comment"""
+        self.append_node(parsetree.Comment, match.group(match.lastindex + 1))
@@ -7,16 +7,18 @@
 """provides runtime services for templates, including Context, Namespace, and various helper functions."""
 
 from mako import exceptions, util
-import __builtin__, inspect, sys
+import __builtin__, inspect, sys, time
+
+_builtins = __builtin__.__dict__
 
 class Context(object):
     """provides runtime namespace, output buffer, and various callstacks for templates."""
     def __init__(self, buffer, **data):
         self._buffer_stack = [buffer]
         self._orig = data  # original data, minus the builtins
-        self._data = __builtin__.__dict__.copy() # the context data which includes builtins
-        self._data.update(data)
-        self._kwargs = data.copy()
+        self._data = dict(_builtins, **data) # the context data which includes builtins
+        # data is ours alone and never modified, so kwargs can share it
+        self._kwargs = data
         self._with_template = None
         self._outputting_as_unicode = None
         self.namespaces = {}
@@ -400,28 +402,83 @@ def _render(template, callable_, args, data, as_unicode=False):
     context._outputting_as_unicode = as_unicode
     context._with_template = template
     
+    start = time.time()
     _render_context(template, callable_, context, *args, **_kwargs_for_callable(callable_, data))
-    return context._pop_buffer().getvalue()
+    result = context._pop_buffer().getvalue()
+    if profiler is not None:
+        profiler.record(template.module._template_uri, None, 
+                            time.time() - start, len(result))
+    return result
 
-def _kwargs_for_callable(callable_, data):
+def _render_stream(template, callable_, out, args, data):
+    """create a Context and write the output of the given template and template 
+    callable to out as it is produced.
+    
+    output is unicode, or encoded if the template has an output_encoding.
+    """
+    
+    buf = util.StreamingBuffer(out, 
+                        unicode=True, 
+                        encoding=template.output_encoding, 
+                        errors=template.encoding_errors)
+    context = Context(buf, **data)
+    context._outputting_as_unicode = not template.output_encoding
+    context._with_template = template
+    
+    start = time.time()
+    _render_context(template, callable_, context, *args, **_kwargs_for_callable(callable_, data))
+    result = context._pop_buffer()
+    if result is buf:
+        buf.flush()
+    else:
+        # an error was formatted into a buffer of its own.  whatever was 
+        # already sent stands, but the error replaces the rest.
+        buf.truncate()
+        buf.out(result.getvalue())
+    if profiler is not None:
+        profiler.record(template.module._template_uri, None, 
+                            time.time() - start, buf.flushed)
+
+def _argnames(callable_):
+    """return (whether callable_ takes \**kwargs, the names of its arguments 
+    other than context), inspecting it only the first time.
+    
+    the result is kept on the callable, so it lives as long as the 
+    template module that defines it.
+    """
+    try:
+        return callable_._mako_argnames
+    except AttributeError:
+        pass
     argspec = inspect.getargspec(callable_)
+    namedargs = []
+    for arg in argspec[0] + [v for v in argspec[1:3] if v is not None]:
+        if arg != 'context' and arg not in namedargs:
+            namedargs.append(arg)
+    argnames = (bool(argspec[2]), tuple(namedargs))
+    try:
+        callable_._mako_argnames = argnames
+    except AttributeError:
+        # bound methods and the like; inspect them every time
+        pass
+    return argnames
+
+def _kwargs_for_callable(callable_, data):
+    varkw, namedargs = _argnames(callable_)
     # for normal pages, **pageargs is usually present
-    if argspec[2]:
+    if varkw:
         return data
     
     # for rendering defs from the top level, figure out the args
-    namedargs = argspec[0] + [v for v in argspec[1:3] if v is not None]
     kwargs = {}
     for arg in namedargs:
-        if arg != 'context' and arg in data and arg not in kwargs:
+        if arg in data:
             kwargs[arg] = data[arg]
     return kwargs
 
 def _kwargs_for_include(callable_, data, **kwargs):
-    argspec = inspect.getargspec(callable_)
-    namedargs = argspec[0] + [v for v in argspec[1:3] if v is not None]
-    for arg in namedargs:
-        if arg != 'context' and arg in data and arg not in kwargs:
+    for arg in _argnames(callable_)[1]:
+        if arg in data and arg not in kwargs:
             kwargs[arg] = data[arg]
     return kwargs
     
@@ -473,3 +530,156 @@ def _render_error(template, context, error):
                                             
         context._with_template = error_template
         error_template.render_context(context, error=error)
+
+class RenderStats(object):
+    """collects the number of calls, time taken and output written by each
+    template render and each def, while profiling is enabled.
+    
+    times are inclusive: a def's time includes the defs it calls, and the 
+    body of a template includes that of the templates inheriting from it.
+    output sizes are in characters.
+    """
+    
+    def __init__(self):
+        self._mutex = util.threading.Lock()
+        self._stats = {}
+        
+    def record(self, uri, name, elapsed, size):
+        """add one call of the def `name` in the template at `uri`.  
+        
+        `name` is 'body' for the template's body, and None for a 
+        complete render of it."""
+        self._mutex.acquire()
+        try:
+            stat = self._stats.get((uri, name))
+            if stat is None:
+                self._stats[(uri, name)] = [1, elapsed, elapsed, size]
+            else:
+                stat[0] += 1
+                stat[1] += elapsed
+                if elapsed > stat[2]:
+                    stat[2] = elapsed
+                stat[3] += size
+        finally:
+            self._mutex.release()
+    
+    def get_stats(self):
+        """return a list of dicts, one per template and def, most 
+        total time first."""
+        self._mutex.acquire()
+        try:
+            items = [(key, list(stat)) for key, stat in self._stats.iteritems()]
+        finally:
+            self._mutex.release()
+        stats = []
+        for (uri, name), (calls, total, max_, size) in items:
+            stats.append({
+                'template':uri, 
+                'def':name, 
+                'calls':calls, 
+                'total_time':total, 
+                'mean_time':total / calls, 
+                'max_time':max_, 
+                'output_size':size,
+                'mean_output_size':size / calls
+            })
+        stats.sort(key=lambda s:(-s['total_time'], s['template'], s['def']))
+        return stats
+        
+    def reset(self):
+        self._mutex.acquire()
+        try:
+            self._stats.clear()
+        finally:
+            self._mutex.release()
+
+# the RenderStats being recorded into, if profiling is enabled
+profiler = None
+
+def enable_profiling(stats=None):
+    """start recording template and def render times into `stats`, a 
+    RenderStats (a new one by default), and return it.
+    
+    defs are only timed in templates loaded while profiling is enabled, 
+    so call this before any are loaded.  disable_profiling() stops the 
+    recording, leaving a negligible cost per def call.
+    """
+    global profiler
+    if stats is None:
+        stats = RenderStats()
+    profiler = stats
+    return stats
+
+def disable_profiling():
+    global profiler
+    profiler = None
+
+def get_stats():
+    """return the statistics recorded so far, as RenderStats.get_stats()
+    does, or an empty list if profiling is not enabled."""
+    if profiler is None:
+        return []
+    return profiler.get_stats()
+
+def reset_stats():
+    if profiler is not None:
+        profiler.reset()
+
+def _output_mark(buf):
+    """return a mark from which _output_since() measures what is 
+    subsequently written to buf."""
+    if isinstance(buf, util.StreamingBuffer):
+        return buf.flushed + buf.size
+    elif isinstance(buf, util.FastEncodingBuffer):
+        return len(buf.data)
+    else:
+        return buf.tell()
+
+def _output_since(buf, mark):
+    if isinstance(buf, util.StreamingBuffer):
+        return buf.flushed + buf.size - mark
+    elif isinstance(buf, util.FastEncodingBuffer):
+        # summing the whole buffer at every def call would be quadratic
+        return sum([len(x) for x in buf.data[mark:]])
+    else:
+        return buf.tell() - mark
+
+def _profile_module(module):
+    """replace the render_* functions of a generated template module 
+    with ones recording their calls into the profiler.
+    
+    the functions call each other through the module's globals, so every 
+    def call, including those from other templates, is recorded.
+    """
+    if getattr(module, '_mako_profiled', False):
+        return
+    uri = module._template_uri
+    for key, value in module.__dict__.items():
+        if key.startswith('render_') and inspect.isfunction(value):
+            setattr(module, key, _profile_callable(uri, key[7:], value))
+    module._mako_profiled = True
+
+def _profile_callable(uri, name, callable_):
+    def profiled(context, *args, **kwargs):
+        stats = profiler
+        if stats is None:
+            return callable_(context, *args, **kwargs)
+        buf = context._buffer_stack[-1]
+        mark = _output_mark(buf)
+        start = time.time()
+        result = None
+        try:
+            result = callable_(context, *args, **kwargs)
+            return result
+        finally:
+            elapsed = time.time() - start
+            size = _output_since(buf, mark)
+            if isinstance(result, basestring):
+                # buffered defs return their output
+                size += len(result)
+            stats.record(uri, name, elapsed, size)
+    # arguments are matched against those of the def, not the wrapper
+    profiled._mako_argnames = _argnames(callable_)
+    profiled.__name__ = callable_.__name__
+    profiled.__doc__ = callable_.__doc__
+    return profiled
@@ -117,6 +117,8 @@ class Template(object):
 
         self.module = module
         self.filename = filename
+        if runtime.profiler is not None:
+            runtime._profile_module(module)
         self.callable_ = self.module.render_body
         self.format_exceptions = format_exceptions
         self.error_handler = error_handler
@@ -197,6 +199,16 @@ class Template(object):
                                 data, 
                                 as_unicode=True)
         
+    def render_stream(self, out, *args, **data):
+        """Render the output of this template to `out` as it is produced, 
+        a few kilobytes at a time, rather than building it as one string.
+        
+        `out` is a file-like object or a write callable.  the output is 
+        unicode, or encoded if the template specifies an output encoding.
+        
+        """
+        runtime._render_stream(self, self.callable_, out, args, data)
+    
     def render_context(self, context, *args, **kwargs):
         """Render this Template with the given context.  
         
@@ -275,6 +287,8 @@ class ModuleTemplate(Template):
                         module_source, 
                         template_source)
         
+        if runtime.profiler is not None:
+            runtime._profile_module(module)
         self.callable_ = self.module.render_body
         self.format_exceptions = format_exceptions
         self.error_handler = error_handler
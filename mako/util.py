@@ -113,62 +113,212 @@ class FastEncodingBuffer(object):
         else:
             return self.delim.join(self.data)
 
-class LRUCache(dict):
-    """A dictionary-like object that stores a limited number of items, discarding
-    lesser used items periodically.
+class StreamingBuffer(object):
+    """a buffer that passes what is written to it on to `out` in chunks of
+    at least `chunk_size` characters, rather than holding all of it.
     
-    this is a rewrite of LRUCache from Myghty to use a periodic timestamp-based
-    paradigm so that synchronization is not really needed.  the size management 
-    is inexact.
+    `out` is a file-like object or a write callable, such as the one a
+    WSGI start_response returns.  call flush() once writing is done.
+    `flushed` counts the characters passed on so far.
     """
     
-    class _Item(object):
-        def __init__(self, key, value):
-            self.key = key
-            self.value = value
-            self.timestamp = time_func()
-        def __repr__(self):
-            return repr(self.value)
+    def __init__(self, out, chunk_size=8192, encoding=None, errors='strict', unicode=False):
+        self.out = getattr(out, 'write', out)
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+        self.errors = errors
+        if unicode:
+            self.delim = u''
+        else:
+            self.delim = ''
+        self.unicode = unicode
+        self.data = []
+        self.size = 0
+        self.flushed = 0
+    
+    def write(self, text):
+        self.data.append(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+    
+    def truncate(self):
+        self.data = []
+        self.size = 0
     
-    def __init__(self, capacity, threshold=.5):
+    def flush(self):
+        if not self.data:
+            return
+        chunk = self.delim.join(self.data)
+        self.flushed += len(chunk)
+        self.truncate()
+        if self.encoding:
+            chunk = chunk.encode(self.encoding, self.errors)
+        self.out(chunk)
+
+class LRUCache(object):
+    """A dictionary-like object that stores at most `capacity` items,
+    discarding the least recently used item to make room for a new one.
+    
+    Keys map to links in a circular doubly linked list kept in order of
+    use, so lookups, insertions and evictions are all O(1).  Every
+    operation holds a lock, so the bound is exact across threads.
+    
+    `hits` and `misses` count lookups through ``[]`` and ``get()``; 
+    ``in`` neither counts nor refreshes an item.
+    """
+    
+    # fields of a link
+    _PREV, _NEXT, _KEY, _VALUE = 0, 1, 2, 3
+    
+    def __init__(self, capacity, threshold=None):
+        # threshold is accepted for compatibility with the former 
+        # timestamp-based cache, whose size it let overshoot capacity.
         self.capacity = capacity
-        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._map = {}
+        self._root = root = []
+        root[:] = [root, root, None, None]
+        self._mutex = threading.Lock()
+    
+    def _unlink(self, link):
+        prev, next = link[self._PREV], link[self._NEXT]
+        prev[self._NEXT] = next
+        next[self._PREV] = prev
+    
+    def _append(self, link):
+        root = self._root
+        last = root[self._PREV]
+        link[self._PREV] = last
+        link[self._NEXT] = root
+        last[self._NEXT] = root[self._PREV] = link
+    
+    def _lookup(self, key):
+        # call with the mutex held
+        link = self._map.get(key)
+        if link is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._unlink(link)
+        self._append(link)
+        return link
+    
+    def _store(self, key, value):
+        # call with the mutex held
+        link = self._map.get(key)
+        if link is not None:
+            link[self._VALUE] = value
+            self._unlink(link)
+            self._append(link)
+            return
+        link = [None, None, key, value]
+        self._map[key] = link
+        self._append(link)
+        while len(self._map) > self.capacity:
+            oldest = self._root[self._NEXT]
+            self._unlink(oldest)
+            del self._map[oldest[self._KEY]]
     
     def __getitem__(self, key):
-        item = dict.__getitem__(self, key)
-        item.timestamp = time_func()
-        return item.value
+        self._mutex.acquire()
+        try:
+            link = self._lookup(key)
+        finally:
+            self._mutex.release()
+        if link is None:
+            raise KeyError(key)
+        return link[self._VALUE]
     
-    def values(self):
-        return [i.value for i in dict.values(self)]
+    def get(self, key, default=None):
+        self._mutex.acquire()
+        try:
+            link = self._lookup(key)
+        finally:
+            self._mutex.release()
+        if link is None:
+            return default
+        return link[self._VALUE]
+    
+    def __setitem__(self, key, value):
+        self._mutex.acquire()
+        try:
+            self._store(key, value)
+        finally:
+            self._mutex.release()
     
     def setdefault(self, key, value):
-        if key in self:
-            return self[key]
-        else:
-            self[key] = value
+        self._mutex.acquire()
+        try:
+            link = self._lookup(key)
+            if link is not None:
+                return link[self._VALUE]
+            self._store(key, value)
             return value
+        finally:
+            self._mutex.release()
     
-    def __setitem__(self, key, value):
-        item = dict.get(self, key)
-        if item is None:
-            item = self._Item(key, value)
-            dict.__setitem__(self, key, item)
-        else:
-            item.value = value
-        self._manage_size()
-    
-    def _manage_size(self):
-        while len(self) > self.capacity + self.capacity * self.threshold:
-            bytime = sorted(dict.values(self), 
-                            key=operator.attrgetter('timestamp'), reverse=True)
-            for item in bytime[self.capacity:]:
-                try:
-                    del self[item.key]
-                except KeyError:
-                    # if we couldnt find a key, most likely some other thread broke in 
-                    # on us. loop around and try again
-                    break
+    def __delitem__(self, key):
+        self._mutex.acquire()
+        try:
+            link = self._map.pop(key)
+            self._unlink(link)
+        finally:
+            self._mutex.release()
+    
+    def pop(self, key, *default):
+        self._mutex.acquire()
+        try:
+            link = self._map.pop(key, None)
+            if link is None:
+                if default:
+                    return default[0]
+                raise KeyError(key)
+            self._unlink(link)
+            return link[self._VALUE]
+        finally:
+            self._mutex.release()
+    
+    def clear(self):
+        self._mutex.acquire()
+        try:
+            self._map.clear()
+            root = self._root
+            root[:] = [root, root, None, None]
+        finally:
+            self._mutex.release()
+    
+    def __contains__(self, key):
+        return key in self._map
+    
+    def __len__(self):
+        return len(self._map)
+    
+    def items(self):
+        """Return (key, value) pairs, least recently used first."""
+        self._mutex.acquire()
+        try:
+            result = []
+            link = self._root[self._NEXT]
+            while link is not self._root:
+                result.append((link[self._KEY], link[self._VALUE]))
+                link = link[self._NEXT]
+            return result
+        finally:
+            self._mutex.release()
+    
+    def keys(self):
+        return [key for key, value in self.items()]
+    
+    def values(self):
+        return [value for key, value in self.items()]
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __repr__(self):
+        return "LRUCache(%r)" % dict(self.items())
 
 # Regexp to match python magic encoding line
 _PYTHON_MAGIC_COMMENT_re = re.compile(
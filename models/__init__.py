@@ -1,7 +1,8 @@
 import datetime
 import logging
 import time
-from google.appengine.ext import db
+
+from storage import db
 
 import SteamApi
 from models.properties import JsonProperty
@@ -23,6 +24,8 @@ class SteamGame(Searchable, db.Model):
     INDEX_TITLE_FROM_PROP = 'name'
     INDEX_ONLY = [ 'name' ]
     INDEX_USES_MULTI_ENTITIES = False
+    INDEX_SNAPSHOT = True
+    INDEX_QUERY_CACHE = True
 
     @property
     def last_updated_on_timestamp(self):
@@ -86,6 +89,35 @@ class SteamGame(Searchable, db.Model):
 
     current_price = property(get_current_price, set_current_price)
 
+    def merge_price_changes(self, price_changes):
+        '''
+        Merges [timestamp, price] pairs from an archive into the price change
+        list, keeping it sorted most recent first. Timestamps already present
+        are left alone. Returns True if anything was added.
+        '''
+        seen = set(change[0] for change in self.price_change_list)
+        new_changes = {}
+        for timestamp, price in price_changes:
+            timestamp = long(timestamp)
+            if timestamp not in seen:
+                new_changes[timestamp] = price
+        if not new_changes:
+            return False
+
+        # Both runs are already mostly sorted, so this is effectively a merge.
+        price_change_list = self.price_change_list + [
+            [timestamp, price] for timestamp, price in new_changes.iteritems()]
+        price_change_list.sort(key=lambda change: change[0], reverse=True)
+
+        self.price_change_list = price_change_list
+        self.price_last_changed = datetime.datetime.fromtimestamp(
+            price_change_list[0][0])
+        return True
+
+    def get_search_popularity(self):
+        # Games whose prices move a lot are the ones people come here for.
+        return len(self.price_change_list)
+
     def to_steam_api(self):
         return SteamApi.Game(
             id=self.steam_id, name=self.name, price=self.current_price)
@@ -1,7 +1,7 @@
 import json
 
-from google.appengine.ext import db
-from google.appengine.api import datastore_types
+from storage import datastore_types
+from storage import db
 
 class JsonProperty(db.TextProperty):
     def get_value_for_datastore(self, model_instance):
@@ -0,0 +1,26 @@
+'''
+Shared remote_api plumbing for the command line tools.
+'''
+
+import getpass
+import logging
+
+import storage
+
+
+def add_options(parser):
+    parser.add_option('--host', default='localhost:8080',
+                      help='app to connect to, via remote_api')
+    parser.add_option('--app_id', default='steam-price-graph-hrd')
+
+
+def connect(options):
+    if storage.BACKEND == 'local':
+        logging.info('Using the local datastore, not connecting to %s',
+                     options.host)
+        return
+    from google.appengine.ext.remote_api import remote_api_stub
+    remote_api_stub.ConfigureRemoteApi(
+        options.app_id, '/_ah/remote_api',
+        lambda: (raw_input('Email: '), getpass.getpass('Password: ')),
+        options.host)
@@ -40,16 +40,18 @@ import re
 import string
 import sys
 
-from google.appengine.api import datastore
-from google.appengine.api import datastore_types
-from google.appengine.ext import db
-from google.appengine.ext import webapp
+import webapp2
 
-# TODO -- This will eventually be moved out of labs namespace
-from google.appengine.api.labs import taskqueue
+import storage
+from storage import datastore
+from storage import datastore_types
+from storage import db
+from storage import taskqueue
 
 # Use python port of Porter2 stemmer.
 from search.pyporter2 import Stemmer
+from search import query_cache
+from search import snapshot
 
 class Error(Exception):
     """Base search module error type."""
@@ -66,6 +68,9 @@ MAX_ENTITY_SEARCH_PHRASES = datastore._MAX_INDEXED_PROPERTIES - 1
 
 SEARCH_PHRASE_MIN_LENGTH = 4
 
+# Shared by indexing and queries so they warm the same stemming cache.
+STEMMER = Stemmer.Stemmer('english')
+
 STOP_WORDS = frozenset([
  'a', 'about', 'according', 'accordingly', 'affected', 'affecting', 'after',
  'again', 'against', 'all', 'almost', 'already', 'also', 'although',
@@ -100,6 +105,15 @@ STOP_WORDS = frozenset([
 
 PUNCTUATION_REGEX = re.compile('[' + re.escape(string.punctuation) + ']')
 
+# Splits text on whitespace and hyphens.  Group 1 is a word that is clean but
+# for at most one trailing punctuation mark, which does not break phrases;
+# group 2 is any other fragment, which has punctuation to strip and starts a
+# new phrase.
+FRAGMENT_REGEX = re.compile(
+    r'([^\s\-%(p)s]+)[%(p)s]?(?=[\s\-]|\Z)|([^\s\-]+)' % {
+        'p': re.escape(string.punctuation)},
+    re.UNICODE)
+
 # Rather than have an extra property name to distinguish stemmed from
 # non-stemmed index entities, we use different Models that are
 # identical to a base index entity.
@@ -136,12 +150,16 @@ class SearchIndex(db.Model):
             return frags[1]
 
     @classmethod
-    def put_index(cls, parent, phrases, index_num=1):
+    def make_index(cls, parent, phrases, index_num=1):
         parent_key = parent.key()
         args = {'key_name': cls.get_index_key_name(parent, index_num),
                 'parent': parent_key, 'parent_kind': parent_key.kind(),
                 'phrases': phrases }
-        return cls(**args).put()
+        return cls(**args)
+
+    @classmethod
+    def put_index(cls, parent, phrases, index_num=1):
+        return cls.make_index(parent, phrases, index_num=index_num).put()
 
 
 class LiteralIndex(SearchIndex):
@@ -252,6 +270,20 @@ class Searchable(object):
     # indexed properties limit (MAX_ENTITY_SEARCH_PHRASES)
     INDEX_USES_MULTI_ENTITIES = True
 
+    # If TRUE, search() answers from an in-memory snapshot of the index when one
+    # has been built (see build_search_snapshot).  Requires key names that are
+    # decimal integers, which are used as the snapshot's document ids.
+    INDEX_SNAPSHOT = False
+
+    # If TRUE, snapshot searches correct words that are in no indexed title to
+    # the closest words that are.
+    INDEX_FUZZY = True
+
+    # If TRUE, search() results are cached (see query_cache) until
+    # query_cache.invalidate is called for the kind, which whatever reindexes
+    # or updates its entities must do.
+    INDEX_QUERY_CACHE = False
+
     @staticmethod
     def full_text_search(phrase, limit=10,
                          kind=None,
@@ -269,56 +301,111 @@ class Searchable(object):
 
         TODO -- Should provide feedback if input search phrase has stop words, etc.
         """
-        index_keys = []
-        keywords = PUNCTUATION_REGEX.sub(' ', phrase).lower().split()
+        results = []
+        for batch in Searchable._full_text_search_batches(
+                phrase, limit=limit, kind=kind, stemming=stemming,
+                multi_word_literal=multi_word_literal):
+            results.extend(batch)
+        return results
+
+    @staticmethod
+    def _full_text_search_batches(phrase, limit=10,
+                                  kind=None,
+                                  stemming=INDEX_STEMMING,
+                                  multi_word_literal=INDEX_MULTI_WORD):
+        """Yields full_text_search results as up to two lists of
+        (key, title) tuples: literal multi-word matches, then keyword matches
+        not already found.
+
+        Both index queries are started before either is read, so they run in
+        parallel, and a caller can act on the literal matches while the
+        keyword query is still coming back.
+        """
         if stemming:
-            stemmer = Stemmer.Stemmer('english')
             klass = StemmedIndex
         else:
             klass = LiteralIndex
+        search_phrases, keywords = Searchable.get_query_phrases(
+            phrase, stemming=stemming, multi_word_literal=multi_word_literal)
 
-        if len(keywords) > 1 and multi_word_literal:
-            # Try to match literal multi-word phrases first
-            if len(keywords) == 2:
-                search_phrases = [' '.join(keywords)]
-            else:
-                search_phrases = []
-                sub_strings = len(keywords) - 2
-                keyword_not_stop_word = map(lambda x: x not in STOP_WORDS, keywords)
-                for pos in xrange(0, sub_strings):
-                    if keyword_not_stop_word[pos] and keyword_not_stop_word[pos+2]:
-                        search_phrases.append(' '.join(keywords[pos:pos+3]))
+        def run(phrases):
+            if not phrases:
+                return []
             query = klass.all(keys_only=True)
-            for phrase in search_phrases:
-                if stemming:
-                    phrase = stemmer.stemWord(phrase)
-                query = query.filter('phrases =', phrase)
+            for search_phrase in phrases:
+                query = query.filter('phrases =', search_phrase)
             if kind:
                 query = query.filter('parent_kind =', kind)
-            index_keys = query.fetch(limit=limit)
+            return query.run(limit=limit, batch_size=limit)
+
+        # Try to match literal multi-word phrases first
+        literal_keys = run(search_phrases)
+        keyword_keys = run(keywords)
+
+        seen = set()
+        for index_keys in (literal_keys, keyword_keys):
+            batch = []
+            for key in index_keys:
+                if len(seen) >= limit:
+                    break
+                if key not in seen:
+                    seen.add(key)
+                    batch.append((key.parent(),
+                                  SearchIndex.get_title(key.name())))
+            if batch:
+                yield batch
 
-        if len(index_keys) < limit:
-            new_limit = limit - len(index_keys)
-            keywords = filter(lambda x: len(x) >= SEARCH_PHRASE_MIN_LENGTH, keywords)
-            if stemming:
-                keywords = stemmer.stemWords(keywords)
-            query = klass.all(keys_only=True)
-            for keyword in keywords:
-                query = query.filter('phrases =', keyword)
-            if kind:
-                query = query.filter('parent_kind =', kind)
-            single_word_matches = [key for key in query.fetch(limit=new_limit) \
-                                   if key not in index_keys]
-            index_keys.extend(single_word_matches)
+    @staticmethod
+    def get_query_words(phrase, stemming=INDEX_STEMMING):
+        """Returns the words of a search phrase as a tuple, lowercased and
+        stemmed if stemming is on.  Queries with the same words are answered
+        alike."""
+        words = PUNCTUATION_REGEX.sub(' ', phrase).lower().split()
+        if stemming:
+            words = STEMMER.stemWords(words)
+        return tuple(words)
+
+    @staticmethod
+    def get_query_phrases(phrase, stemming=INDEX_STEMMING,
+                          multi_word_literal=INDEX_MULTI_WORD):
+        """Breaks a search phrase into the index phrases to look up.
+
+        Args:
+            phrase: String.  Search phrase.
+
+        Returns:
+            A (literal_phrases, keywords) tuple of lists.  literal_phrases are
+            the two or three-word phrases that must all match for a literal
+            multi-word hit; keywords are the single words that must all
+            match otherwise.  Both are stemmed if stemming is on.  Either
+            list may be empty, in which case it matches nothing.
+        """
+        keywords = PUNCTUATION_REGEX.sub(' ', phrase).lower().split()
+        # Stem each word once; phrases are joined from stemmed words, as
+        # get_search_phraseset builds them.
+        terms = STEMMER.stemWords(keywords) if stemming else keywords
+
+        search_phrases = []
+        if len(keywords) > 1 and multi_word_literal:
+            if len(keywords) == 2:
+                search_phrases = [' '.join(terms)]
+            else:
+                for pos in xrange(0, len(keywords) - 2):
+                    if (keywords[pos] not in STOP_WORDS and
+                            keywords[pos + 2] not in STOP_WORDS):
+                        search_phrases.append(' '.join(terms[pos:pos + 3]))
 
-        return [(key.parent(), SearchIndex.get_title(key.name())) for key in index_keys]
+        keywords = [term for keyword, term in zip(keywords, terms)
+                    if len(keyword) >= SEARCH_PHRASE_MIN_LENGTH]
+        return search_phrases, keywords
 
     @classmethod
-    def get_simple_search_phraseset(cls, text):
+    def get_simple_search_phraseset(cls, text, stemmer=None):
         """Returns a simple set of keywords from given text.
 
         Args:
             text: String.
+            stemmer: Optional Stemmer to stem the keywords with.
 
         Returns:
             A set of keywords that aren't stop words and meet length requirement.
@@ -335,17 +422,21 @@ class Searchable(object):
             for word in list(words):
                 if len(word) < SEARCH_PHRASE_MIN_LENGTH:
                     words.remove(word)
+            if stemmer:
+                words = set(stemmer.stemWords(words))
         else:
             words = set()
         return words
 
     @classmethod
-    def get_search_phraseset(cls, text):
+    def get_search_phraseset(cls, text, stemmer=None):
         """Returns set of phrases, including two and three adjacent word phrases
            not spanning punctuation or stop words.
 
         Args:
             text: String with punctuation.
+            stemmer: Optional Stemmer.  Each word is stemmed once, and phrases
+                are made of the stemmed words.
 
         Returns:
             A set of search terms that aren't stop words and meet length
@@ -360,40 +451,33 @@ class Searchable(object):
         >>> Searchable.get_search_phraseset('Recalling friends, past and present.')
         set(['recalling', 'recalling friends', 'friends'])
         """
-        if text:
-            datastore_types.ValidateString(text, 'text', max_len=sys.maxint)
-            text = text.lower()
-            phrases = []
-            two_words = []
-            three_words = ['', '']
-            three_words_no_stop = [False, False]
-            text = text.replace('-', ' ')
-            fragments = text.split()
-            for frag in fragments:
-                word, replaced = PUNCTUATION_REGEX.subn('', frag)
-                not_end_punctuation = (replaced > 1 or frag[-1] not in string.punctuation)
-                if replaced and not_end_punctuation:
-                    two_words = []
-                    three_words = ['', '']
-                three_words.append(word)  # We allow stop words in middle
-                if word in STOP_WORDS:
-                    two_words = []
-                    three_words_no_stop.append(False)
-                else:
-                    two_words.append(word)
-                    three_words_no_stop.append(True)
-                    if len(word) >= SEARCH_PHRASE_MIN_LENGTH:
-                        phrases.append(word)
-                    if len(two_words) == 2:
-                        phrases.append(' '.join(two_words))
-                        del two_words[0]
-                    if len(three_words) == 3 and three_words_no_stop[0]:
-                        phrases.append(' '.join(three_words))
-                del three_words[0]
-                del three_words_no_stop[0]
-            phrases = set(phrases)
-        else:
-            phrases = set()
+        phrases = set()
+        if not text:
+            return phrases
+        datastore_types.ValidateString(text, 'text', max_len=sys.maxint)
+        add = phrases.add
+        # The previous two words of the current phrase run, stemmed, and
+        # whether they were stop words.  None where the run is shorter.
+        last = second_last = None
+        last_stop = second_last_stop = True
+        for match in FRAGMENT_REGEX.finditer(text.lower()):
+            word = match.group(1)
+            if word is None:
+                word = PUNCTUATION_REGEX.sub('', match.group(2))
+                last = second_last = None
+                if not word:
+                    continue
+            term = stemmer.stemWord(word) if stemmer else word
+            stop = word in STOP_WORDS
+            if not stop:
+                if len(word) >= SEARCH_PHRASE_MIN_LENGTH:
+                    add(term)
+                if last is not None and not last_stop:
+                    add(last + ' ' + term)
+                if second_last is not None and not second_last_stop:
+                    add(second_last + ' ' + last + ' ' + term)
+            second_last, second_last_stop = last, last_stop
+            last, last_stop = term, stop
         return phrases
 
     @classmethod
@@ -401,7 +485,11 @@ class Searchable(object):
         """Queries search indices for phrases using a merge-join.
 
         Use of this class method lets you easily restrict searches to a kind
-        and retrieve entities or keys.
+        and retrieve entities or keys.  If INDEX_SNAPSHOT is set and a
+        snapshot exists, results come from it instead, ranked by relevance
+        (see snapshot.InvertedIndex.rank) and including partial matches.
+        If INDEX_FUZZY is also set, query words that no title has are first
+        corrected to the closest words that one does.
 
         Args:
             phrase: Search phrase (string)
@@ -412,32 +500,133 @@ class Searchable(object):
             A list.  If keys_only is True, the list holds (key, title) tuples.
             If keys_only is False, the list holds Model instances.
         """
-        key_list = Searchable.full_text_search(
-                        phrase, limit=limit, kind=cls.kind(),
-                        stemming=cls.INDEX_STEMMING,
-                        multi_word_literal=cls.INDEX_MULTI_WORD)
+        index = generation = None
+        if cls.INDEX_SNAPSHOT:
+            index, generation = snapshot.get_snapshot_and_generation(
+                cls.kind())
+
+        cache_key = None
+        if cls.INDEX_QUERY_CACHE:
+            # Instances pick up a new snapshot up to snapshot.CHECK_INTERVAL
+            # after invalidate() is called, so results are cached under the
+            # snapshot they came from as well.
+            cache_key, results = query_cache.get(
+                cls.kind(), generation, Searchable.get_query_words(
+                    phrase, stemming=cls.INDEX_STEMMING),
+                limit, keys_only)
+            if results is not None:
+                return results
+
+        if index is not None:
+            key_list = cls.search_snapshot(index, phrase, limit=limit)
+            entity_rpcs = []
+            if key_list and not keys_only:
+                entity_rpcs.append(
+                    db.get_async([key for key, title in key_list]))
+        else:
+            # Start fetching each batch of entities as soon as its keys are
+            # in, overlapping the literal matches with the keyword query.
+            key_list = []
+            entity_rpcs = []
+            for batch in Searchable._full_text_search_batches(
+                    phrase, limit=limit, kind=cls.kind(),
+                    stemming=cls.INDEX_STEMMING,
+                    multi_word_literal=cls.INDEX_MULTI_WORD):
+                key_list.extend(batch)
+                if not keys_only:
+                    entity_rpcs.append(
+                        db.get_async([key for key, title in batch]))
         if keys_only:
             logging.debug("key_list: %s", key_list)
-            return key_list
+            results = key_list
         else:
-            return [cls.get(key_and_title[0]) for key_and_title in key_list]
+            results = []
+            for rpc in entity_rpcs:
+                results.extend(rpc.get_result())
+        if cache_key:
+            query_cache.set(cache_key, results)
+        return results
+
+    @classmethod
+    def search_snapshot(cls, index, phrase, limit=10):
+        """Returns ranked (key, title) tuples for phrase from a snapshot."""
+        search_phrases, keywords = Searchable.get_query_phrases(
+            phrase, stemming=cls.INDEX_STEMMING,
+            multi_word_literal=cls.INDEX_MULTI_WORD)
+        if cls.INDEX_FUZZY and not all(keyword in index.postings
+                                       for keyword in keywords):
+            corrected = index.fuzzy_index.correct(phrase)
+            if corrected:
+                logging.debug("Corrected %r to %r", phrase, corrected)
+                phrase = corrected
+                search_phrases, keywords = Searchable.get_query_phrases(
+                    phrase, stemming=cls.INDEX_STEMMING,
+                    multi_word_literal=cls.INDEX_MULTI_WORD)
+        stem = STEMMER.stemWord if cls.INDEX_STEMMING else None
+        return [(db.Key.from_path(cls.kind(), str(doc_id)), title)
+                for doc_id, title in index.rank(
+                    search_phrases, keywords,
+                    prefix=Searchable.get_query_words(
+                        phrase, stemming=cls.INDEX_STEMMING),
+                    stem=stem, limit=limit)]
+
+    @classmethod
+    def build_search_snapshot(cls, batch_size=200):
+        """Builds and saves an in-memory index snapshot of every entity.
+
+        Entities are read in batches, so only the index itself has to fit in
+        memory.
+
+        Returns:
+            The new snapshot.InvertedIndex.
+        """
+        index = snapshot.InvertedIndex()
+        for entity in storage.iter_all(cls, batch_size=batch_size):
+            title = None
+            if hasattr(cls, 'INDEX_TITLE_FROM_PROP'):
+                title = getattr(entity, cls.INDEX_TITLE_FROM_PROP, None)
+            index.add(int(entity.key().name()), title,
+                      entity.get_search_phrases(),
+                      popularity=entity.get_search_popularity())
+        index.finish()
+        snapshot.save_snapshot(cls.kind(), index)
+        if cls.INDEX_QUERY_CACHE:
+            query_cache.invalidate(cls.kind())
+        return index
+
+    @classmethod
+    def autocomplete(cls, text, limit=10):
+        """Completes partially typed titles from the search snapshot.
+
+        Returns:
+            A list of (key, title) tuples, most popular first.  Empty if no
+            snapshot has been built for this kind.
+        """
+        index = snapshot.get_snapshot(cls.kind())
+        if index is None:
+            return []
+        return [(db.Key.from_path(cls.kind(), str(doc_id)), title)
+                for doc_id, title in index.prefix_index.complete(
+                    text, limit=limit)]
+
+    def get_search_popularity(self):
+        """Returns a number ranking this entity in completions; higher first."""
+        return 0
 
     def indexed_title_changed(self):
         """Renames index entities for this model to match new title."""
-        klass = StemmedIndex if self.INDEX_STEMMING else LiteralIndex
-        query = klass.all(keys_only=True).ancestor(self.key())
-        old_index_keys = query.fetch(1000)
         if not hasattr(self, 'INDEX_TITLE_FROM_PROP'):
             raise IndexTitleError('Must declare a property name via INDEX_TITLE_FROM_PROP')
-        new_keys = []
-        for old_key in old_index_keys:
-            old_index = db.get(old_key)
-            index_num = SearchIndex.get_index_num(old_key.name())
-            index_key = klass.put_index(parent=self, index_num=index_num,
-                                        phrases=old_index.phrases)
-            new_keys.append(index_key)
-        delete_keys = filter(lambda key: key not in new_keys, old_index_keys)
-        db.delete(delete_keys)
+        klass = StemmedIndex if self.INDEX_STEMMING else LiteralIndex
+        old_indexes = klass.all().ancestor(self.key()).fetch(1000)
+        new_indexes = [
+            klass.make_index(parent=self, phrases=old_index.phrases,
+                             index_num=SearchIndex.get_index_num(
+                                 old_index.key().name()))
+            for old_index in old_indexes]
+        new_keys = set(db.put(new_indexes))
+        db.delete([old_index.key() for old_index in old_indexes
+                   if old_index.key() not in new_keys])
 
     def get_search_phrases(self, indexing_func=None):
         """Returns search phrases from properties in a given Model instance.
@@ -456,14 +645,19 @@ class Searchable(object):
                 phrases like "statue of liberty."
             INDEX_STEMMING: Returns stemmed phrases.
         """
-        if not indexing_func:
+        stemmer = STEMMER if self.INDEX_STEMMING else None
+        if indexing_func:
+            if stemmer:
+                custom_func = indexing_func
+                indexing_func = lambda text: stemmer.stemWords(
+                    custom_func(text))
+        else:
             klass = self.__class__
             if klass.INDEX_MULTI_WORD:
-                indexing_func = klass.get_search_phraseset
+                phraseset_func = klass.get_search_phraseset
             else:
-                indexing_func = klass.get_simple_search_phraseset
-        if self.INDEX_STEMMING:
-            stemmer = Stemmer.Stemmer('english')
+                phraseset_func = klass.get_simple_search_phraseset
+            indexing_func = lambda text: phraseset_func(text, stemmer=stemmer)
         phrases = set()
         for prop_name, prop_value in self.properties().iteritems():
             if (not self.INDEX_ONLY) or (prop_name in self.INDEX_ONLY):
@@ -473,12 +667,7 @@ class Searchable(object):
                 if (isinstance(values[0], basestring) and
                         not isinstance(values[0], datastore_types.Blob)):
                     for value in values:
-                        words = indexing_func(value)
-                        if self.INDEX_STEMMING:
-                            stemmed_words = set(stemmer.stemWords(words))
-                            phrases.update(stemmed_words)
-                        else:
-                            phrases.update(words)
+                        phrases.update(indexing_func(value))
         return list(phrases)
 
     def index(self, indexing_func=None):
@@ -490,38 +679,77 @@ class Searchable(object):
         Note that the indexing_func can be passed in to allow more customized
         search phrase generation.
         """
-        search_phrases = self.get_search_phrases(indexing_func=indexing_func)
+        self.__class__.index_entities([self], indexing_func=indexing_func)
 
-        key = self.key()
-        klass = StemmedIndex if self.INDEX_STEMMING else LiteralIndex
+    @classmethod
+    def index_entities(cls, entities, indexing_func=None):
+        """Brings the search index entities of many instances up to date.
 
-        if self.__class__.INDEX_USES_MULTI_ENTITIES:
-            query = klass.all(keys_only=True).ancestor(key)
-            previous_index_keys = query.fetch(1000)
-        num_phrases = len(search_phrases)
-
-        start_index = 0
-        entity_num = 1      # Appended to key name of index entity
-        index_keys = []
-        while (num_phrases > 0):
-            cur_num_phrases = min(num_phrases, MAX_ENTITY_SEARCH_PHRASES)
-            end_index = start_index + cur_num_phrases
-            num_indices = (num_phrases - 1) / MAX_ENTITY_SEARCH_PHRASES + 1
-            index_key = klass.put_index(parent=self, index_num=entity_num,
-                                        phrases=search_phrases[start_index:end_index])
-            index_keys.append(index_key)
-            if self.__class__.INDEX_USES_MULTI_ENTITIES:
-                start_index = end_index
-                num_phrases -= cur_num_phrases
-                entity_num += 1
-            else:
-                num_phrases = 0    # Only write one index entity
-        if self.__class__.INDEX_USES_MULTI_ENTITIES:
-            delete_keys = []
-            for key in previous_index_keys:
-                if key not in index_keys:
-                    delete_keys.append(key)
-            db.delete(delete_keys)
+        Each instance's phrases are diffed against its current index
+        entities.  If the phrase set is unchanged nothing is written, unless
+        the title changed, in which case the index entities are renamed with
+        their phrases as they are.  Reads and writes are batched across all
+        instances.
+
+        Returns:
+            The number of instances whose index entities were written.
+        """
+        klass = StemmedIndex if cls.INDEX_STEMMING else LiteralIndex
+        # Start every instance's query before reading any, so they overlap.
+        queries = [klass.all().ancestor(entity.key()).run(limit=1000)
+                   for entity in entities]
+        to_put = []
+        to_delete = []
+        written = 0
+        for entity, query in zip(entities, queries):
+            old_indexes = dict((old_index.key(), old_index)
+                               for old_index in query)
+            new_indexes = entity._make_indexes(
+                klass, old_indexes.values(), indexing_func=indexing_func)
+            changed = False
+            new_keys = set()
+            for new_index in new_indexes:
+                new_keys.add(new_index.key())
+                old_index = old_indexes.get(new_index.key())
+                if old_index is None or old_index.phrases != new_index.phrases:
+                    to_put.append(new_index)
+                    changed = True
+            for old_key in old_indexes:
+                if old_key not in new_keys:
+                    to_delete.append(old_key)
+                    changed = True
+            if changed:
+                written += 1
+        db.put(to_put)
+        db.delete(to_delete)
+        return written
+
+    def _make_indexes(self, klass, old_indexes, indexing_func=None):
+        """Returns the unsaved index entities this instance should have.
+
+        Phrase lists are taken from old_indexes if they hold the same phrase
+        set, so an unchanged index compares equal to the stored one.
+        """
+        search_phrases = self.get_search_phrases(indexing_func=indexing_func)
+        old_phrases = set()
+        for old_index in old_indexes:
+            old_phrases.update(old_index.phrases)
+        if old_indexes and old_phrases == set(search_phrases):
+            chunks = [(SearchIndex.get_index_num(old_index.key().name()),
+                       old_index.phrases) for old_index in old_indexes]
+        elif self.__class__.INDEX_USES_MULTI_ENTITIES:
+            chunks = [(index_num + 1, search_phrases[start:start +
+                                                     MAX_ENTITY_SEARCH_PHRASES])
+                      for index_num, start in enumerate(xrange(
+                          0, len(search_phrases), MAX_ENTITY_SEARCH_PHRASES))]
+        elif search_phrases:
+            # Only write one index entity
+            chunks = [(1, search_phrases[:MAX_ENTITY_SEARCH_PHRASES])]
+        else:
+            chunks = []
+        return [klass.make_index(parent=self, phrases=phrases,
+                                 index_num=index_num)
+                for index_num, phrases in chunks]
 
     def enqueue_indexing(self, url, only_index=None):
         """Adds an indexing task to the default task queue.
@@ -536,7 +764,7 @@ class Searchable(object):
                 params['only_index'] = ' '.join(only_index)
             taskqueue.add(url=url, params=params)
 
-class SearchIndexing(webapp.RequestHandler):
+class SearchIndexing(webapp2.RequestHandler):
     """Handler for full text indexing task."""
     def post(self):
         key_str = self.request.get('key')
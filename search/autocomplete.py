@@ -0,0 +1,151 @@
+"""Prefix completion over indexed titles.
+
+PrefixIndex keeps every distinct normalized title token in one sorted list,
+with a parallel list of the documents containing each token ordered by
+popularity.  A prefix lookup is a binary search for the token range followed
+by a merge of at most `limit` documents off the front of each posting list.
+Results for one and two character prefixes, whose ranges are the widest, are
+precomputed.
+
+It is derived from a search snapshot's titles and popularity, so it costs no
+datastore access.  It is not stored with the snapshot: each instance builds
+it when it loads a new snapshot (see snapshot.get_snapshot), which takes a
+few tenths of a second for tens of thousands of titles.
+"""
+
+import bisect
+import heapq
+import re
+import string
+
+# Unlike the search index, completion keeps stop words and short words, since
+# the user is still typing them.
+TOKEN_REGEX = re.compile(r'[^\s' + re.escape(string.punctuation) + ']+',
+                         re.UNICODE)
+
+PRECOMPUTED_PREFIX_LENGTH = 2
+
+DEFAULT_LIMIT = 10
+
+
+def tokenize(text):
+    return TOKEN_REGEX.findall(text.lower()) if text else []
+
+
+class PrefixIndex(object):
+
+    def __init__(self, titles, popularity=None, limit=DEFAULT_LIMIT):
+        """
+        Args:
+            titles: Dict of doc_id -> title.
+            popularity: Dict of doc_id -> number; higher ranks first.
+            limit: Most results precomputed per short prefix.
+        """
+        popularity = popularity or {}
+        self.titles = titles
+        self.limit = limit
+        # Sort key per document: most popular first, then by title.
+        self._rank = dict(
+            (doc_id, (-popularity.get(doc_id, 0), title))
+            for doc_id, title in titles.iteritems())
+
+        token_docs = {}
+        for doc_id, title in titles.iteritems():
+            for token in set(tokenize(title)):
+                token_docs.setdefault(token, []).append(doc_id)
+        self.tokens = sorted(token_docs)
+        self.postings = [sorted(token_docs[token], key=self._rank.__getitem__)
+                         for token in self.tokens]
+        # _posting_offsets[i] is the number of postings of tokens before i.
+        self._posting_offsets = [0]
+        for doc_ids in self.postings:
+            self._posting_offsets.append(
+                self._posting_offsets[-1] + len(doc_ids))
+
+        self._short = {}
+        for token in self.tokens:
+            for length in xrange(1, min(len(token),
+                                        PRECOMPUTED_PREFIX_LENGTH) + 1):
+                prefix = token[:length]
+                if prefix not in self._short:
+                    self._short[prefix] = self._scan(prefix, limit)
+
+    def _range(self, prefix):
+        start = bisect.bisect_left(self.tokens, prefix)
+        end = bisect.bisect_left(self.tokens, prefix + u'\uffff', start)
+        return start, end
+
+    def _scan(self, prefix, limit, accept=None):
+        """Merges the posting lists of all tokens starting with prefix."""
+        start, end = self._range(prefix)
+        rank = self._rank
+        heads = []
+        for i in xrange(start, end):
+            heads.append((rank[self.postings[i][0]], i, 0))
+        heapq.heapify(heads)
+        results = []
+        seen = set()
+        while heads and len(results) < limit:
+            unused_rank, i, pos = heapq.heappop(heads)
+            doc_id = self.postings[i][pos]
+            if doc_id not in seen:
+                seen.add(doc_id)
+                if accept is None or accept(doc_id):
+                    results.append(doc_id)
+            if pos + 1 < len(self.postings[i]):
+                heapq.heappush(heads, (rank[self.postings[i][pos + 1]],
+                                       i, pos + 1))
+        return results
+
+    def _filter(self, prefix, limit, doc_ids):
+        """Returns the best ranked of doc_ids with a token starting with prefix.
+
+        Cheaper than _scan() with accept when doc_ids are fewer than the
+        postings it would walk.
+        """
+        results = []
+        for doc_id in sorted(doc_ids, key=self._rank.__getitem__):
+            for token in tokenize(self.titles[doc_id]):
+                if token.startswith(prefix):
+                    results.append(doc_id)
+                    break
+            if len(results) >= limit:
+                break
+        return results
+
+    def _docs_with_token(self, token):
+        i = bisect.bisect_left(self.tokens, token)
+        if i < len(self.tokens) and self.tokens[i] == token:
+            return set(self.postings[i])
+        return set()
+
+    def complete(self, text, limit=DEFAULT_LIMIT):
+        """Returns (doc_id, title) tuples for titles matching typed text.
+
+        Every word but the last must appear in the title; the last one may
+        be a prefix of a title word.
+        """
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+        prefix = tokens[-1]
+        if len(tokens) == 1:
+            if prefix in self._short and limit <= self.limit:
+                doc_ids = self._short[prefix][:limit]
+            else:
+                doc_ids = self._scan(prefix, limit)
+        else:
+            required = None
+            for token in tokens[:-1]:
+                docs = self._docs_with_token(token)
+                required = docs if required is None else required & docs
+                if not required:
+                    return []
+            start, end = self._range(prefix)
+            if len(required) < (self._posting_offsets[end] -
+                                self._posting_offsets[start]):
+                doc_ids = self._filter(prefix, limit, required)
+            else:
+                doc_ids = self._scan(prefix, limit,
+                                     accept=required.__contains__)
+        return [(doc_id, self.titles[doc_id]) for doc_id in doc_ids]
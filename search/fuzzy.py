@@ -0,0 +1,129 @@
+"""Typo tolerant matching of query words against indexed titles.
+
+TrigramIndex maps every character trigram of every distinct title word to
+the words containing it.  A misspelled word is corrected by counting shared
+trigrams to find candidates, which by the q-gram lemma must share at least
+a certain number with any word within the allowed edit distance, and then
+verifying just those candidates with an edit distance bounded to give up as
+soon as it exceeds the limit.
+
+Like autocomplete.PrefixIndex it is derived from a search snapshot's titles,
+so corrections cost no datastore access.
+"""
+
+from search import autocomplete
+
+# Words shorter than this are left alone; they are not searched as keywords
+# and have too few trigrams to correct reliably.
+MIN_WORD_LENGTH = 4
+
+PAD = '$'
+
+
+def max_distance(word):
+    """Edits allowed when correcting word."""
+    return 1 if len(word) <= 5 else 2
+
+
+def trigrams(word):
+    padded = PAD + PAD + word + PAD
+    return [padded[i:i + 3] for i in xrange(len(padded) - 2)]
+
+
+def bounded_edit_distance(a, b, bound):
+    """Returns the Levenshtein distance between a and b, or bound + 1 if it
+    is greater than bound.
+
+    Only the diagonal band of width 2 * bound + 1 is filled in, and a row
+    whose every cell exceeds bound ends the search early.
+    """
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    if len(a) > len(b):
+        a, b = b, a
+    too_far = bound + 1
+    previous = range(len(b) + 1)
+    for i in xrange(1, len(a) + 1):
+        start = max(1, i - bound)
+        end = min(len(b), i + bound)
+        current = [too_far] * (len(b) + 1)
+        if start == 1:
+            current[0] = i
+        char = a[i - 1]
+        row_min = current[0]
+        for j in xrange(start, end + 1):
+            cost = previous[j - 1] + (char != b[j - 1])
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost if cost < too_far else too_far
+            if cost < row_min:
+                row_min = cost
+        if row_min > bound:
+            return too_far
+        previous = current
+    return min(previous[len(b)], too_far)
+
+
+class TrigramIndex(object):
+
+    def __init__(self, titles):
+        """
+        Args:
+            titles: Dict of doc_id -> title.
+        """
+        # word -> number of titles containing it
+        self.frequency = {}
+        for title in titles.itervalues():
+            for word in set(autocomplete.tokenize(title)):
+                self.frequency[word] = self.frequency.get(word, 0) + 1
+        self.words = sorted(word for word in self.frequency
+                            if len(word) >= MIN_WORD_LENGTH - 1)
+        self.postings = {}
+        for word_id, word in enumerate(self.words):
+            for trigram in set(trigrams(word)):
+                self.postings.setdefault(trigram, []).append(word_id)
+
+    def candidates(self, word, distance):
+        """Returns indexes of words that may be within distance of word."""
+        grams = set(trigrams(word))
+        shared = {}
+        for trigram in grams:
+            for word_id in self.postings.get(trigram, ()):
+                shared[word_id] = shared.get(word_id, 0) + 1
+        # Each edit changes at most three trigrams.
+        needed = len(grams) - 3 * distance
+        return [word_id for word_id, count in shared.iteritems()
+                if count >= needed]
+
+    def correct_word(self, word):
+        """Returns the closest indexed word to word, or None if none is
+        within max_distance(word).  Ties go to the word in more titles."""
+        if word in self.frequency or len(word) < MIN_WORD_LENGTH:
+            return None
+        distance = max_distance(word)
+        best = None
+        for word_id in self.candidates(word, distance):
+            candidate = self.words[word_id]
+            found = bounded_edit_distance(word, candidate, distance)
+            if found > distance:
+                continue
+            rank = (found, -self.frequency[candidate], candidate)
+            if best is None or rank < best:
+                best = rank
+        return best and best[2]
+
+    def correct(self, text):
+        """Returns text with misspelled words replaced by their closest
+        indexed words, or None if there was nothing to correct."""
+        words = autocomplete.tokenize(text)
+        corrected = False
+        for i, word in enumerate(words):
+            replacement = self.correct_word(word)
+            if replacement:
+                words[i] = replacement
+                corrected = True
+        if not corrected:
+            return None
+        return ' '.join(words)
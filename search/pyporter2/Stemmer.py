@@ -24,9 +24,14 @@
 """pyporter2: An implementation of the Porter2 stemming algorithm.
 
 See http://snowball.tartarus.org/algorithms/english/stemmer.html"""
-import unittest, re
+import collections, threading, unittest, re
+
+VOWELS = 'aeiouy'
 
 regexp = re.compile(r"[^aeiouy]*[aeiouy]+[^aeiouy](\w*)")
+vowel_regexp = re.compile(r"[aeiouy]")
+consonant_y_regexp = re.compile(r"([aeiouy])y")
+
 def get_r1(word):
     # exceptional forms
     if word.startswith('gener') or word.startswith('arsen'):
@@ -40,19 +45,19 @@ def get_r1(word):
         return match.start(1)
     return len(word)
 
-def get_r2(word):
-    match = regexp.match(word, get_r1(word))
+def get_r2(word, r1=None):
+    if r1 is None:
+        r1 = get_r1(word)
+    match = regexp.match(word, r1)
     if match:
         return match.start(1)
     return len(word)
 
 def ends_with_short_syllable(word):
     if len(word) == 2:
-        if re.match(r"^[aeiouy][^aeiouy]$", word):
-            return True
-    if re.match(r".*[^aeiouy][aeiouy][^aeiouywxY]$", word):
-        return True
-    return False
+        return word[0] in VOWELS and word[1] not in VOWELS
+    return (len(word) > 2 and word[-1] not in 'aeiouywxY' and
+            word[-2] in VOWELS and word[-3] not in VOWELS)
 
 def is_short_word(word):
     if ends_with_short_syllable(word):
@@ -66,9 +71,29 @@ def remove_initial_apostrophe(word):
     return word
 
 def capitalize_consonant_ys(word):
+    if 'y' not in word:
+        return word
     if word.startswith('y'):
         word = 'Y' + word[1:]
-    return re.sub(r"([aeiouy])y", '\g<1>Y', word)
+    return consonant_y_regexp.sub('\g<1>Y', word)
+
+def suffix_lengths(table):
+    return sorted(set(len(suffix) for suffix in table), reverse=True)
+
+def longest_suffix(word, table, lengths):
+    """Returns the longest key of table that word ends with, or None.
+
+    lengths are the lengths of table's keys, longest first.
+    """
+    for length in lengths:
+        suffix = word[-length:]
+        if suffix in table:
+            return suffix
+    return None
+
+# The steps below look up the longest matching suffix in a table rather than
+# trying each suffix in turn. The algorithm always acts on the longest
+# matching suffix, even when its condition then fails.
 
 def step_0(word):
     if word.endswith("'s'"):
@@ -90,142 +115,129 @@ def step_1a(word):
     if word.endswith('us') or word.endswith('ss'):
         return word
     if word.endswith('s'):
-        preceding = word[:-1]
-        if re.search(r"[aeiouy].", preceding):
-            return preceding
+        # Delete if there is a vowel before the letter preceding the s.
+        if vowel_regexp.search(word, 0, len(word) - 2):
+            return word[:-1]
         return word
     return word
 
+step_1b_suffixes = {'eedly': 'ee',
+                    'eed': 'ee',
+                    'ed': None,
+                    'edly': None,
+                    'ing': None,
+                    'ingly': None}
+step_1b_lengths = suffix_lengths(step_1b_suffixes)
+
+step_1b_doubles = frozenset(
+    ['bb', 'dd', 'ff', 'gg', 'mm', 'nn', 'pp', 'rr', 'tt'])
+
+def step_1b_helper(word):
+    if word[-2:] in ('at', 'bl', 'iz'):
+        return word + 'e'
+    if word[-2:] in step_1b_doubles:
+        return word[:-1]
+    if is_short_word(word):
+        return word + 'e'
+    return word
+
 def step_1b(word, r1):
-    if word.endswith('eedly'):
-        if len(word) - 5 >= r1:
-            return word[:-3]
+    suffix = longest_suffix(word, step_1b_suffixes, step_1b_lengths)
+    if suffix is None:
         return word
-    if word.endswith('eed'):
-        if len(word) - 3 >= r1:
-            return word[:-1]
+    end = len(word) - len(suffix)
+    replacement = step_1b_suffixes[suffix]
+    if replacement is not None:
+        if end >= r1:
+            return word[:end] + replacement
         return word
-
-    def ends_with_double(word):
-        doubles = ['bb', 'dd', 'ff', 'gg', 'mm', 'nn', 'pp', 'rr', 'tt']
-        for double in doubles:
-            if word.endswith(double):
-                return True
-        return False
-
-    def step_1b_helper(word):
-        if word.endswith('at') or word.endswith('bl') or word.endswith('iz'):
-            return word + 'e'
-        if ends_with_double(word):
-            return word[:-1]
-        if is_short_word(word):
-            return word + 'e'
-        return word
-
-    suffixes = ['ed', 'edly', 'ing', 'ingly']
-    for suffix in suffixes:
-        if word.endswith(suffix):
-            preceding = word[:-len(suffix)]
-            if re.search(r"[aeiouy]", preceding):
-                return step_1b_helper(preceding)
-            return word
-
+    if vowel_regexp.search(word, 0, end):
+        return step_1b_helper(word[:end])
     return word
 
 def step_1c(word):
     if word.endswith('y') or word.endswith('Y'):
-        if word[-2] not in 'aeiouy':
-            if len(word) > 2:
-                return word[:-1] + 'i'
+        if len(word) > 2 and word[-2] not in VOWELS:
+            return word[:-1] + 'i'
     return word
 
-def step_2(word, r1):
-    def step_2_helper(end, repl, prev):
-        if word.endswith(end):
-            if len(word) - len(end) >= r1:
-                if prev == []:
-                    return word[:-len(end)] + repl
-                for p in prev:
-                    if word[:-len(end)].endswith(p):
-                        return word[:-len(end)] + repl
-            return word
-        return None
-
-    triples = [('ization', 'ize', []),
-               ('ational', 'ate', []),
-               ('fulness', 'ful', []),
-               ('ousness', 'ous', []),
-               ('iveness', 'ive', []),
-               ('tional', 'tion', []),
-               ('biliti', 'ble', []),
-               ('lessli', 'less', []),
-               ('entli', 'ent', []),
-               ('ation', 'ate', []),
-               ('alism', 'al', []),
-               ('aliti', 'al', []),
-               ('ousli', 'ous', []),
-               ('iviti', 'ive', []),
-               ('fulli', 'ful', []),
-               ('enci', 'ence', []),
-               ('anci', 'ance', []),
-               ('abli', 'able', []),
-               ('izer', 'ize', []),
-               ('ator', 'ate', []),
-               ('alli', 'al', []),
-               ('bli', 'ble', []),
-               ('ogi', 'og', ['l']),
-               ('li', '', ['c', 'd', 'e', 'g', 'h', 'k', 'm', 'n', 'r', 't'])]
-
-    for trip in triples:
-        attempt = step_2_helper(trip[0], trip[1], trip[2])
-        if attempt:
-            return attempt
+# suffix -> (replacement, letters one of which must precede the suffix)
+step_2_suffixes = {'ization': ('ize', None),
+                   'ational': ('ate', None),
+                   'fulness': ('ful', None),
+                   'ousness': ('ous', None),
+                   'iveness': ('ive', None),
+                   'tional': ('tion', None),
+                   'biliti': ('ble', None),
+                   'lessli': ('less', None),
+                   'entli': ('ent', None),
+                   'ation': ('ate', None),
+                   'alism': ('al', None),
+                   'aliti': ('al', None),
+                   'ousli': ('ous', None),
+                   'iviti': ('ive', None),
+                   'fulli': ('ful', None),
+                   'enci': ('ence', None),
+                   'anci': ('ance', None),
+                   'abli': ('able', None),
+                   'izer': ('ize', None),
+                   'ator': ('ate', None),
+                   'alli': ('al', None),
+                   'bli': ('ble', None),
+                   'ogi': ('og', 'l'),
+                   'li': ('', 'cdeghkmnrt')}
+step_2_lengths = suffix_lengths(step_2_suffixes)
 
+def step_2(word, r1):
+    suffix = longest_suffix(word, step_2_suffixes, step_2_lengths)
+    if suffix is None:
+        return word
+    end = len(word) - len(suffix)
+    if end < r1:
+        return word
+    replacement, preceding = step_2_suffixes[suffix]
+    if preceding is None or (end and word[end - 1] in preceding):
+        return word[:end] + replacement
     return word
 
-def step_3(word, r1, r2):
-    def step_3_helper(end, repl, r2_necessary):
-        if word.endswith(end):
-            if len(word) - len(end) >= r1:
-                if not r2_necessary:
-                    return word[:-len(end)] + repl
-                else:
-                    if len(word) - len(end) >= r2:
-                        return word[:-len(end)] + repl
-            return word
-        return None
-
-    triples = [('ational', 'ate', False),
-               ('tional', 'tion', False),
-               ('alize', 'al', False),
-               ('icate', 'ic', False),
-               ('iciti', 'ic', False),
-               ('ative', '', True),
-               ('ical', 'ic', False),
-               ('ness', '', False),
-               ('ful', '', False)]
-
-    for trip in triples:
-        attempt = step_3_helper(trip[0], trip[1], trip[2])
-        if attempt:
-            return attempt
+# suffix -> (replacement, whether the suffix must also be in R2)
+step_3_suffixes = {'ational': ('ate', False),
+                   'tional': ('tion', False),
+                   'alize': ('al', False),
+                   'icate': ('ic', False),
+                   'iciti': ('ic', False),
+                   'ative': ('', True),
+                   'ical': ('ic', False),
+                   'ness': ('', False),
+                   'ful': ('', False)}
+step_3_lengths = suffix_lengths(step_3_suffixes)
 
+def step_3(word, r1, r2):
+    suffix = longest_suffix(word, step_3_suffixes, step_3_lengths)
+    if suffix is None:
+        return word
+    end = len(word) - len(suffix)
+    replacement, r2_necessary = step_3_suffixes[suffix]
+    if end >= r1 and (not r2_necessary or end >= r2):
+        return word[:end] + replacement
     return word
 
-def step_4(word, r2):
-    delete_list = ['al', 'ance', 'ence', 'er', 'ic', 'able', 'ible', 'ant', 'ement', 'ment', 'ent', 'ism', 'ate', 'iti', 'ous', 'ive', 'ize']
-
-    for end in delete_list:
-        if word.endswith(end):
-            if len(word) - len(end) >= r2:
-                return word[:-len(end)]
-            return word
-
-    if word.endswith('sion') or word.endswith('tion'):
-        if len(word) - 3 >= r2:
-            return word[:-3]
+# 'ion' is only deleted after an s or t.
+step_4_suffixes = frozenset(
+    ['al', 'ance', 'ence', 'er', 'ic', 'able', 'ible', 'ant', 'ement', 'ment',
+     'ent', 'ism', 'ate', 'iti', 'ous', 'ive', 'ize', 'ion'])
+step_4_lengths = suffix_lengths(step_4_suffixes)
 
-    return word
+def step_4(word, r2):
+    suffix = longest_suffix(word, step_4_suffixes, step_4_lengths)
+    if suffix is None:
+        return word
+    end = len(word) - len(suffix)
+    if end < r2:
+        return word
+    if suffix == 'ion' and not (end and word[end - 1] in 'st'):
+        return word
+    return word[:end]
 
 def step_5(word, r1, r2):
     if word.endswith('l'):
@@ -263,7 +275,7 @@ exceptional_forms = {'skis': 'ski',
                     'bias': 'bias',
                     'andes': 'andes'}
 
-exceptional_early_exit_post_1a = ['inning', 'outing', 'canning', 'herring', 'earring', 'proceed', 'exceed', 'succeed']
+exceptional_early_exit_post_1a = frozenset(['inning', 'outing', 'canning', 'herring', 'earring', 'proceed', 'exceed', 'succeed'])
 
 def stem(word):
     """The main entry point in the old version of the API."""
@@ -294,14 +306,20 @@ class Stemmer:
     function in this module. In addition, the appropriate stemming algorithm
     for a given language may be obtained by using the 2 or 3 letter ISO 639
     language codes.
+
+    The optional cache_size argument bounds the number of stemmed words
+    remembered by this instance, least recently used first out. A cache size
+    of 0 disables the cache. The cache is safe to share between threads.
     """
     max_cache_size = 10000
 
     def __init__ (self, algorithm, cache_size=None):
         if algorithm not in ['english', 'eng', 'en']:
             raise KeyError("Stemming algorithm '%s' not found" % algorithm)
-        if cache_size:
+        if cache_size is not None:
             self.max_cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._cache_lock = threading.Lock()
 
     def stemWord(self, word):
         """Stem a word.
@@ -313,7 +331,22 @@ class Stemmer:
         was a unicode object, the result will be a unicode object: if the
         word supplied was a string, the result will be a UTF-8 encoded string.
         """
-        return Stemmer._stem(word)
+        if not self.max_cache_size:
+            return Stemmer._stem(word)
+        cache = self._cache
+        # u'word' == 'word', so entries remember which type they were for.
+        word_type = type(word)
+        with self._cache_lock:
+            entry = cache.pop(word, None)
+            if entry is not None and entry[0] is word_type:
+                cache[word] = entry
+                return entry[1]
+        stemmed = Stemmer._stem(word)
+        with self._cache_lock:
+            cache[word] = (word_type, stemmed)
+            if len(cache) > self.max_cache_size:
+                cache.popitem(last=False)
+        return stemmed
 
     def stemWords(self, words):
         """Stem a list of words.
@@ -333,23 +366,19 @@ class Stemmer:
 
     @classmethod
     def _stem(cls, word):
-        was_unicode = False
-
-        if isinstance(word, unicode):
-            was_unicode = True
-            word = word.encode('utf-8')
-
+        # Unicode words are stemmed as they are: every suffix the algorithm
+        # looks for is ASCII, so there is no need to encode to UTF-8 first.
         if len(word) <= 2:
             return word
         word = remove_initial_apostrophe(word)
 
         # handle some exceptional forms
         if word in exceptional_forms:
-            return exceptional_forms[word]
+            return type(word)(exceptional_forms[word])
 
         word = capitalize_consonant_ys(word)
         r1 = get_r1(word)
-        r2 = get_r2(word)
+        r2 = get_r2(word, r1)
         word = step_0(word)
         word = step_1a(word)
 
@@ -363,11 +392,7 @@ class Stemmer:
         word = step_3(word, r1, r2)
         word = step_4(word, r2)
         word = step_5(word, r1, r2)
-        word = normalize_ys(word)
-
-        if was_unicode:
-            return word.decode('utf-8')
-        return word
+        return normalize_ys(word)
 
 class TestPorter2(unittest.TestCase):
     def setUp(self):
@@ -0,0 +1,81 @@
+"""Caches search results until the indexed entities change.
+
+Results are held in a per-instance LRU with memcache behind it, under keys
+that include the kind's current generation number.  The generation lives in
+memcache and is bumped by invalidate() whenever entities of the kind are
+reindexed, so every instance stops serving stale results at once without
+having to find and delete them; they simply age out.
+
+That only covers what is read at lookup time.  Results computed from data
+an instance loaded earlier, such as a search snapshot, must include its
+version among the key parts, or they would be cached under the new
+generation while the instance still holds the old data.
+
+A lookup costs one memcache get for the generation, plus one for the entry
+if this instance has not seen the query yet, and no datastore access.
+"""
+
+import hashlib
+import time
+
+from mako import util
+from storage import memcache
+
+# Entries kept per instance.
+MAX_LOCAL_ENTRIES = 1000
+
+# Seconds entries live in memcache.  Invalidation does not depend on this.
+MEMCACHE_TIME = 24 * 60 * 60
+
+NAMESPACE = 'search-query'
+
+
+_local = util.LRUCache(MAX_LOCAL_ENTRIES)
+
+
+def _generation_key(kind):
+    return '%s:generation:%s' % (NAMESPACE, kind)
+
+
+def get_generation(kind):
+    key = _generation_key(kind)
+    generation = memcache.get(key)
+    if generation is None:
+        # Never set, or evicted.  Start from the clock rather than zero so we
+        # never go back to a generation that entries were cached under.
+        memcache.add(key, int(time.time() * 1000))
+        generation = memcache.get(key)
+    return generation
+
+
+def invalidate(kind):
+    """Makes every cached result for kind stale."""
+    memcache.incr(_generation_key(kind),
+                  initial_value=int(time.time() * 1000))
+
+
+def make_key(kind, generation, *parts):
+    # Hashed to keep memcache keys short whatever the query.
+    return '%s:%s:%s:%s' % (NAMESPACE, kind, generation,
+                            hashlib.sha1(repr(parts)).hexdigest())
+
+
+def get(kind, *parts):
+    """Looks up a cached value for parts.
+
+    Returns:
+        A (cache_key, value) tuple.  value is None on a miss; pass cache_key
+        to set() to store it.
+    """
+    cache_key = make_key(kind, get_generation(kind), *parts)
+    value = _local.get(cache_key)
+    if value is None:
+        value = memcache.get(cache_key)
+        if value is not None:
+            _local[cache_key] = value
+    return cache_key, value
+
+
+def set(cache_key, value):
+    _local[cache_key] = value
+    memcache.set(cache_key, value, time=MEMCACHE_TIME)
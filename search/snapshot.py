@@ -0,0 +1,271 @@
+"""In-memory snapshots of the search index.
+
+A snapshot is a compact inverted index (phrase -> sorted array of integer
+document ids) plus the title and popularity of each document, built from the
+same phrases the StemmedIndex / LiteralIndex entities hold.  It is serialized
+into a blob, stored in the datastore in chunks under a per-kind pointer entity,
+and loaded lazily by each instance, which then answers searches without any
+datastore queries.
+
+Snapshots are rebuilt wholesale (see Searchable.build_search_snapshot) and
+instances look for a newer one at most every CHECK_INTERVAL seconds, so
+entities indexed since the last build are not found until the next one.
+"""
+
+import array
+import heapq
+import logging
+import marshal
+import math
+import time
+import zlib
+
+from search import autocomplete
+from search import fuzzy
+from storage import db
+
+SNAPSHOT_VERSION = 2
+
+# Stay well under the 1MB entity size limit.
+MAX_PART_BYTES = 900 * 1024
+
+# Seconds between checks for a newer snapshot.
+CHECK_INTERVAL = 300
+
+# Relevance weights for InvertedIndex.rank.
+KEYWORD_WEIGHT = 1.0
+PHRASE_WEIGHT = 1.0
+TITLE_PREFIX_WEIGHT = 0.5
+POPULARITY_WEIGHT = 0.25
+
+
+class InvertedIndex(object):
+    """Maps phrases to sorted arrays of integer document ids."""
+
+    def __init__(self, titles=None, postings=None, popularity=None):
+        self.titles = titles or {}
+        self.postings = postings or {}
+        self.popularity = popularity or {}
+        self._prefix_index = None
+        self._fuzzy_index = None
+        self._max_popularity = None
+
+    def add(self, doc_id, title, phrases, popularity=0):
+        self.titles[doc_id] = title
+        if popularity:
+            self.popularity[doc_id] = popularity
+        for phrase in phrases:
+            self.postings.setdefault(phrase, []).append(doc_id)
+
+    def finish(self):
+        """Turns the posting lists built by add() into sorted arrays."""
+        for phrase, doc_ids in self.postings.iteritems():
+            self.postings[phrase] = array.array('i', sorted(set(doc_ids)))
+        return self
+
+    def rank(self, literal_phrases, keywords, prefix=(), stem=None,
+             limit=10):
+        """Returns the documents most relevant to a query, best first.
+
+        Every document matching at least one keyword or literal phrase is
+        scored in one pass over their posting lists:
+
+            KEYWORD_WEIGHT * fraction of the keywords it has
+          + PHRASE_WEIGHT * fraction of the literal phrases it has
+          + TITLE_PREFIX_WEIGHT if its title starts with the query words
+          + POPULARITY_WEIGHT * its popularity, log scaled to [0, 1]
+
+        Ties go to the alphabetically first title.
+
+        Args:
+            literal_phrases, keywords: As from Searchable.get_query_phrases.
+            prefix: The query's words, for the title prefix boost.
+            stem: Function applied to title words before comparing them to
+                prefix, if prefix is stemmed.
+            limit: Number of documents to return.
+
+        Returns:
+            A list of (doc_id, title) tuples.
+        """
+        scores = {}
+        for phrases, weight in ((set(keywords), KEYWORD_WEIGHT),
+                                (set(literal_phrases), PHRASE_WEIGHT)):
+            if not phrases:
+                continue
+            weight /= len(phrases)
+            for phrase in phrases:
+                for doc_id in self.postings.get(phrase, ()):
+                    scores[doc_id] = scores.get(doc_id, 0.0) + weight
+        if not scores:
+            return []
+
+        prefix = ' '.join(prefix)
+        max_popularity = self.max_popularity
+        for doc_id in scores:
+            if prefix and self._title_starts_with(doc_id, prefix, stem):
+                scores[doc_id] += TITLE_PREFIX_WEIGHT
+            popularity = self.popularity.get(doc_id)
+            if popularity:
+                scores[doc_id] += POPULARITY_WEIGHT * (
+                    math.log1p(popularity) / max_popularity)
+
+        titles = self.titles
+        doc_ids = heapq.nsmallest(
+            limit, scores,
+            key=lambda doc_id: (-scores[doc_id], titles.get(doc_id)))
+        return [(doc_id, titles.get(doc_id)) for doc_id in doc_ids]
+
+    def _title_starts_with(self, doc_id, prefix, stem):
+        words = autocomplete.tokenize(self.titles.get(doc_id))
+        # The prefix cannot span more title words than it has.
+        words = words[:prefix.count(' ') + 1]
+        if stem:
+            words = [stem(word) for word in words]
+        return ' '.join(words).startswith(prefix)
+
+    @property
+    def max_popularity(self):
+        """log1p of the highest popularity, for scaling popularity scores."""
+        if self._max_popularity is None:
+            self._max_popularity = math.log1p(
+                max(self.popularity.itervalues()) if self.popularity else 0)
+        return self._max_popularity
+
+    @property
+    def prefix_index(self):
+        """The autocomplete.PrefixIndex over this snapshot's titles."""
+        if self._prefix_index is None:
+            self._prefix_index = autocomplete.PrefixIndex(
+                self.titles, self.popularity)
+        return self._prefix_index
+
+    @property
+    def fuzzy_index(self):
+        """The fuzzy.TrigramIndex over this snapshot's titles."""
+        if self._fuzzy_index is None:
+            self._fuzzy_index = fuzzy.TrigramIndex(self.titles)
+        return self._fuzzy_index
+
+    def dumps(self):
+        postings = dict((phrase, doc_ids.tostring())
+                        for phrase, doc_ids in self.postings.iteritems())
+        return zlib.compress(marshal.dumps(
+            (SNAPSHOT_VERSION, self.titles, postings, self.popularity)))
+
+    @classmethod
+    def loads(cls, blob):
+        fields = marshal.loads(zlib.decompress(blob))
+        version = fields[0]
+        if version != SNAPSHOT_VERSION:
+            raise ValueError('Unsupported snapshot version %r' % version)
+        unused_version, titles, packed, popularity = fields
+        postings = {}
+        for phrase, packed_ids in packed.iteritems():
+            doc_ids = array.array('i')
+            doc_ids.fromstring(packed_ids)
+            postings[phrase] = doc_ids
+        return cls(titles=titles, postings=postings, popularity=popularity)
+
+
+class SearchSnapshot(db.Model):
+    """Datastore home of serialized snapshots.
+
+    The entity keyed by the indexed kind's name points at the current
+    generation; the blob itself is split over parts keyed
+    'kind||generation||part'.
+    """
+    data = db.BlobProperty()
+    generation = db.IntegerProperty()
+    parts = db.IntegerProperty()
+
+    @staticmethod
+    def get_part_key_name(kind, generation, part):
+        return '%s||%d||%d' % (kind, generation, part)
+
+
+# kind -> (index, generation, time of last check), per instance.
+_loaded = {}
+
+
+def save_snapshot(kind, index):
+    """Stores index as the current snapshot for kind."""
+    blob = index.dumps()
+    generation = int(time.time() * 1000)
+    parts = []
+    for start in xrange(0, len(blob), MAX_PART_BYTES):
+        parts.append(SearchSnapshot(
+            key_name=SearchSnapshot.get_part_key_name(
+                kind, generation, len(parts)),
+            data=db.Blob(blob[start:start + MAX_PART_BYTES])))
+    db.put(parts)
+
+    previous = SearchSnapshot.get_by_key_name(kind)
+    SearchSnapshot(key_name=kind, generation=generation,
+                   parts=len(parts)).put()
+    if previous is not None:
+        db.delete([db.Key.from_path(
+            SearchSnapshot.kind(),
+            SearchSnapshot.get_part_key_name(kind, previous.generation, part))
+            for part in xrange(previous.parts)])
+    _loaded[kind] = (index, generation, time.time())
+    logging.info('Saved %s search snapshot %d: %d documents, %d phrases, '
+                 '%d bytes', kind, generation, len(index.titles),
+                 len(index.postings), len(blob))
+
+
+def load_snapshot(kind, pointer=None):
+    """Loads the current snapshot for kind, or None if there is none."""
+    if pointer is None:
+        pointer = SearchSnapshot.get_by_key_name(kind)
+        if pointer is None:
+            return None
+    parts = SearchSnapshot.get_by_key_name(
+        [SearchSnapshot.get_part_key_name(kind, pointer.generation, part)
+         for part in xrange(pointer.parts)])
+    if None in parts:
+        logging.warning('Search snapshot %d for %s is incomplete',
+                        pointer.generation, kind)
+        return None
+    return InvertedIndex.loads(''.join(part.data for part in parts))
+
+
+def get_snapshot(kind):
+    """Returns this instance's snapshot for kind, loading it if needed.
+
+    At most once every CHECK_INTERVAL seconds this costs a single get of the
+    pointer entity, and a batched get of the parts if a newer snapshot has
+    been saved since.
+    """
+    return get_snapshot_and_generation(kind)[0]
+
+
+def get_snapshot_and_generation(kind):
+    """Like get_snapshot, but returns an (index, generation) tuple.
+
+    The generation identifies the snapshot, so that anything derived from
+    it can be told apart from what is derived from another.  Both are None
+    if there is no snapshot.
+    """
+    now = time.time()
+    index, generation, checked_at = _loaded.get(kind, (None, None, 0))
+    if now - checked_at < CHECK_INTERVAL:
+        return index, generation
+    pointer = SearchSnapshot.get_by_key_name(kind)
+    if pointer is not None and pointer.generation != generation:
+        try:
+            loaded = load_snapshot(kind, pointer)
+        except ValueError, e:
+            # Written by a different version of this module, mid-deploy.
+            logging.warning('Ignoring %s search snapshot: %s', kind, e)
+            loaded = None
+        if loaded is not None:
+            # Build the completion and spelling correction indexes now,
+            # along with the rest of the load, rather than on the next
+            # keystroke or misspelled search.
+            loaded.prefix_index
+            loaded.fuzzy_index
+            index, generation = loaded, pointer.generation
+    elif pointer is None:
+        index, generation = None, None
+    _loaded[kind] = (index, generation, now)
+    return index, generation
@@ -0,0 +1,51 @@
+'''
+Picks the datastore implementation used by models, search and main.
+
+On App Engine this is simply google.appengine.ext.db and friends. Setting the
+STORAGE_BACKEND environment variable to "local" swaps in storage.local, an
+in-process stand-in that implements the parts of the db API this app uses, so
+the crawler, search and page rendering can run without the SDK:
+
+  STORAGE_BACKEND=local python local_server.py
+
+Everything else should import these modules from here rather than from
+google.appengine directly.
+'''
+
+import os
+
+BACKEND = os.environ.get('STORAGE_BACKEND', 'appengine')
+
+if BACKEND == 'local':
+    from storage.local import datastore
+    from storage.local import datastore_types
+    from storage.local import db
+    from storage.local import memcache
+    from storage.local import taskqueue
+elif BACKEND == 'appengine':
+    from google.appengine.api import datastore
+    from google.appengine.api import datastore_types
+    from google.appengine.api import memcache
+    from google.appengine.api import taskqueue
+    from google.appengine.ext import db
+else:
+    raise ImportError('Unknown STORAGE_BACKEND %r' % BACKEND)
+
+
+def iter_all(model_class, batch_size=200):
+    '''
+    Yields every entity of model_class in key order, fetching batch_size
+    entities per round trip and resuming each batch from the previous cursor,
+    so only one batch is held in memory at a time.
+    '''
+    cursor = None
+    while True:
+        query = model_class.all()
+        if cursor:
+            query.with_cursor(cursor)
+        batch = query.fetch(batch_size)
+        for entity in batch:
+            yield entity
+        if len(batch) < batch_size:
+            break
+        cursor = query.cursor()
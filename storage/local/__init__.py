@@ -0,0 +1,8 @@
+'''
+In-process stand-ins for the App Engine services used by this app.
+
+Entities are held in memory. If STORAGE_LOCAL_PATH is set, every put and
+delete is also written through to a SQLite file at that path, and the file is
+loaded back on startup, so a catalog crawled or imported in one run can be
+served or benchmarked in the next.
+'''
@@ -0,0 +1,3 @@
+'''Constants mirrored from google.appengine.api.datastore.'''
+
+_MAX_INDEXED_PROPERTIES = 20000
@@ -0,0 +1,26 @@
+'''The subset of google.appengine.api.datastore_types used by this app.'''
+
+
+class BadValueError(Exception):
+    """Raised when a property value is invalid."""
+
+
+class Text(unicode):
+    """A long string that is never indexed."""
+
+
+class Blob(str):
+    """A byte string that is never indexed."""
+
+
+def ValidateString(value, name='unused', exception=BadValueError,
+                   max_len=1500, empty_ok=False):
+    if value is None and empty_ok:
+        return
+    if not isinstance(value, basestring) or isinstance(value, Blob):
+        raise exception('%s should be a string; received %s (a %s):' %
+                        (name, value, type(value).__name__))
+    if not value and not empty_ok:
+        raise exception('%s must not be empty.' % name)
+    if len(value.encode('utf-8')) > max_len:
+        raise exception('%s must be under %d bytes.' % (name, max_len))
@@ -0,0 +1,741 @@
+'''
+In-process stand-in for google.appengine.ext.db.
+
+Implements the operations this app relies on: keyed get/put/delete (single or
+batched), get_by_key_name, ancestor and equality filters (including equality
+against list properties, which is what StemmedIndex searches need), sort
+orders and cursors. Indexed property values are kept in per-kind inverted
+indexes, so equality filters are answered with set intersections much like
+the datastore's merge-join rather than by scanning every entity.
+
+Entities are stored as their datastore values (what get_value_for_datastore
+returns) and rebuilt on every get, so custom properties like JsonProperty go
+through the same serialization they would in production.
+'''
+
+import base64
+import bisect
+import cPickle as pickle
+import datetime
+import json
+import os
+import threading
+
+from storage.local import datastore_types
+from storage.local.datastore_types import BadValueError, Blob, Text
+
+
+class Error(Exception):
+    """Base local datastore error type."""
+
+
+class BadArgumentError(Error):
+    """Raised when a query or key is given a bad argument."""
+
+
+class BadKeyError(Error):
+    """Raised when a key cannot be decoded."""
+
+
+class KindError(Error):
+    """Raised when an entity is loaded as the wrong kind."""
+
+
+class Key(object):
+    '''An entity key: a path of (kind, key name or numeric id) pairs.'''
+
+    def __init__(self, encoded=None):
+        self._path = ()
+        if encoded is not None:
+            try:
+                path = json.loads(base64.urlsafe_b64decode(str(encoded)))
+            except (TypeError, ValueError):
+                raise BadKeyError('Invalid key %r' % encoded)
+            self._path = tuple((kind, id_or_name) for kind, id_or_name in path)
+
+    @classmethod
+    def _from_path(cls, path):
+        key = cls.__new__(cls)
+        key._path = tuple(path)
+        return key
+
+    @classmethod
+    def from_path(cls, kind, id_or_name, parent=None):
+        path = parent._path if parent is not None else ()
+        return cls._from_path(path + ((kind, id_or_name),))
+
+    def kind(self):
+        return self._path[-1][0]
+
+    def id_or_name(self):
+        return self._path[-1][1]
+
+    def name(self):
+        id_or_name = self.id_or_name()
+        return id_or_name if isinstance(id_or_name, basestring) else None
+
+    def id(self):
+        id_or_name = self.id_or_name()
+        return None if isinstance(id_or_name, basestring) else id_or_name
+
+    def parent(self):
+        if len(self._path) < 2:
+            return None
+        return Key._from_path(self._path[:-1])
+
+    def has_ancestor(self, ancestor):
+        return self._path[:len(ancestor._path)] == ancestor._path
+
+    def __str__(self):
+        return base64.urlsafe_b64encode(json.dumps(self._path))
+
+    def __repr__(self):
+        return 'datastore_types.Key.from_path(%s)' % ', '.join(
+            '%r, %r' % pair for pair in self._path)
+
+    def __eq__(self, other):
+        return isinstance(other, Key) and self._path == other._path
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._path)
+
+    def __cmp__(self, other):
+        return cmp(self._path, other._path)
+
+
+class Property(object):
+    data_type = basestring
+
+    def __init__(self, verbose_name=None, name=None, default=None,
+                 required=False, indexed=True, **kwargs):
+        self.verbose_name = verbose_name
+        self.name = name
+        self.default = default
+        self.required = required
+        self.indexed = indexed
+
+    def __property_config__(self, model_class, property_name):
+        self.model_class = model_class
+        if self.name is None:
+            self.name = property_name
+
+    def __get__(self, model_instance, model_class):
+        if model_instance is None:
+            return self
+        return model_instance._values.get(self.name, self.default)
+
+    def __set__(self, model_instance, value):
+        model_instance._values[self.name] = self.validate(value)
+
+    def default_value(self):
+        return self.default
+
+    def empty(self, value):
+        return not value
+
+    def validate(self, value):
+        if self.empty(value):
+            if self.required:
+                raise BadValueError('Property %s is required' % self.name)
+        elif self.data_type is not None and \
+                not isinstance(value, self.data_type):
+            raise BadValueError('Property %s must be a %s' %
+                                (self.name, self._type_name()))
+        return value
+
+    def _type_name(self):
+        if isinstance(self.data_type, tuple):
+            return ' or '.join(t.__name__ for t in self.data_type)
+        return self.data_type.__name__
+
+    def get_value_for_datastore(self, model_instance):
+        return self.__get__(model_instance, model_instance.__class__)
+
+    def make_value_from_datastore(self, value):
+        return value
+
+    def index_values(self, value):
+        '''Returns the values an equality filter on this property matches.'''
+        if not self.indexed or isinstance(value, (Text, Blob)):
+            return ()
+        return (value,)
+
+
+class StringProperty(Property):
+    data_type = basestring
+
+
+class TextProperty(Property):
+    data_type = Text
+
+    def __init__(self, *args, **kwargs):
+        kwargs['indexed'] = False
+        super(TextProperty, self).__init__(*args, **kwargs)
+
+    def validate(self, value):
+        if isinstance(value, basestring) and not isinstance(value, Text):
+            value = Text(value)
+        return super(TextProperty, self).validate(value)
+
+
+class BlobProperty(Property):
+    data_type = Blob
+
+    def __init__(self, *args, **kwargs):
+        kwargs['indexed'] = False
+        super(BlobProperty, self).__init__(*args, **kwargs)
+
+    def validate(self, value):
+        if isinstance(value, str) and not isinstance(value, Blob):
+            value = Blob(value)
+        return super(BlobProperty, self).validate(value)
+
+
+class IntegerProperty(Property):
+    data_type = (int, long)
+
+    def empty(self, value):
+        return value is None
+
+    def validate(self, value):
+        if isinstance(value, bool):
+            raise BadValueError('Property %s must be a %s' %
+                                (self.name, self._type_name()))
+        return super(IntegerProperty, self).validate(value)
+
+
+class DateTimeProperty(Property):
+    data_type = datetime.datetime
+
+    def __init__(self, verbose_name=None, auto_now=False, auto_now_add=False,
+                 **kwargs):
+        super(DateTimeProperty, self).__init__(verbose_name, **kwargs)
+        self.auto_now = auto_now
+        self.auto_now_add = auto_now_add
+
+    def get_value_for_datastore(self, model_instance):
+        if self.auto_now or (self.auto_now_add and
+                             self.__get__(model_instance, None) is None):
+            model_instance._values[self.name] = datetime.datetime.now()
+        return super(DateTimeProperty, self).get_value_for_datastore(
+            model_instance)
+
+
+class StringListProperty(Property):
+    data_type = list
+
+    def __init__(self, verbose_name=None, default=None, **kwargs):
+        if default is None:
+            default = []
+        super(StringListProperty, self).__init__(
+            verbose_name, default=default, **kwargs)
+
+    def empty(self, value):
+        return value is None
+
+    def validate(self, value):
+        value = super(StringListProperty, self).validate(value)
+        if value is not None:
+            for item in value:
+                if not isinstance(item, basestring):
+                    raise BadValueError('Items in %s must be strings' %
+                                        self.name)
+        return value
+
+    def get_value_for_datastore(self, model_instance):
+        return list(super(StringListProperty, self).get_value_for_datastore(
+            model_instance))
+
+    def index_values(self, value):
+        if not self.indexed:
+            return ()
+        return set(value)
+
+
+_kind_map = {}
+
+
+class PropertiedClass(type):
+    def __init__(cls, name, bases, dct):
+        super(PropertiedClass, cls).__init__(name, bases, dct)
+        cls._properties = {}
+        for base in reversed(cls.__mro__[1:]):
+            cls._properties.update(getattr(base, '_properties', {}))
+        for attr_name, attr in dct.items():
+            if isinstance(attr, Property):
+                attr.__property_config__(cls, attr_name)
+                cls._properties[attr.name] = attr
+        if name != 'Model':
+            _kind_map[cls.kind()] = cls
+
+
+class Model(object):
+    __metaclass__ = PropertiedClass
+
+    def __init__(self, parent=None, key_name=None, _from_entity=False,
+                 **kwargs):
+        if isinstance(parent, Model):
+            parent = parent.key()
+        self._parent = parent
+        self._key_name = key_name
+        self._key = None
+        self._values = {}
+        if _from_entity:
+            return
+        for name, prop in self.properties().iteritems():
+            if name in kwargs:
+                setattr(self, name, kwargs[name])
+            else:
+                setattr(self, name, prop.default_value())
+
+    @classmethod
+    def kind(cls):
+        return cls.__name__
+
+    @classmethod
+    def properties(cls):
+        return dict(cls._properties)
+
+    def key(self):
+        if self._key is not None:
+            return self._key
+        if self._key_name is not None:
+            return Key.from_path(self.kind(), self._key_name,
+                                 parent=self._parent)
+        raise Error('Entity %s has not been put yet' % self.kind())
+
+    def is_saved(self):
+        return self._key is not None
+
+    def parent_key(self):
+        return self._parent
+
+    def parent(self):
+        if self._parent is None:
+            return None
+        return get(self._parent)
+
+    def put(self):
+        return put(self)
+
+    save = put
+
+    def delete(self):
+        delete(self)
+
+    def _to_entity(self):
+        return dict((name, prop.get_value_for_datastore(self))
+                    for name, prop in self._properties.iteritems())
+
+    @classmethod
+    def _from_entity(cls, key, entity):
+        model = cls(parent=key.parent(), key_name=key.name(),
+                    _from_entity=True)
+        model._key = key
+        for name, prop in cls._properties.iteritems():
+            if name in entity:
+                model._values[name] = prop.make_value_from_datastore(
+                    entity[name])
+            else:
+                model._values[name] = prop.default_value()
+        return model
+
+    @classmethod
+    def all(cls, keys_only=False):
+        return Query(cls, keys_only=keys_only)
+
+    @classmethod
+    def get(cls, keys):
+        results = get(keys)
+        for result in (results if isinstance(results, list) else [results]):
+            if result is not None and not isinstance(result, cls):
+                raise KindError('Kind %r is not a subclass of kind %r' %
+                                (result.kind(), cls.kind()))
+        return results
+
+    @classmethod
+    def get_by_key_name(cls, key_names, parent=None):
+        if isinstance(parent, Model):
+            parent = parent.key()
+        multiple = isinstance(key_names, (list, tuple))
+        if not multiple:
+            key_names = [key_names]
+        keys = [Key.from_path(cls.kind(), name, parent=parent)
+                for name in key_names]
+        results = cls.get(keys)
+        return results if multiple else results[0]
+
+
+class _Store(object):
+    '''
+    Entities by key, the key paths of each kind in order, plus inverted
+    indexes of kind -> property -> value -> set of keys for every indexed
+    property value.
+    '''
+
+    def __init__(self, path=None):
+        self._lock = threading.RLock()
+        self._entities = {}
+        self._by_kind = {}
+        self._indexes = {}
+        self._next_id = 1
+        self._path = path
+        self._sqlite = None
+
+    def _open(self):
+        # Loaded on first use rather than at import, so that the model
+        # classes whose properties we index have all been defined.
+        if self._path is None or self._sqlite is not None:
+            return
+        import sqlite3
+        self._sqlite = sqlite3.connect(self._path, check_same_thread=False)
+        self._sqlite.execute('CREATE TABLE IF NOT EXISTS entities '
+                             '(key TEXT PRIMARY KEY, kind TEXT, data BLOB)')
+        for encoded, kind, data in self._sqlite.execute(
+                'SELECT key, kind, data FROM entities'):
+            key = Key(encoded)
+            self._insert(key, pickle.loads(str(data)))
+            if key.id() is not None:
+                self._next_id = max(self._next_id, key.id() + 1)
+
+    def allocate_id(self):
+        with self._lock:
+            self._open()
+            next_id = self._next_id
+            self._next_id += 1
+            return next_id
+
+    def _index_entries(self, key, entity):
+        model_class = _kind_map.get(key.kind())
+        if model_class is None:
+            return
+        for name, prop in model_class._properties.iteritems():
+            if name in entity:
+                for value in prop.index_values(entity[name]):
+                    yield name, value
+
+    def _insert(self, key, entity):
+        if not self._remove(key, unlist=False):
+            bisect.insort(self._by_kind.setdefault(key.kind(), []), key._path)
+        self._entities[key] = entity
+        kind_index = self._indexes.setdefault(key.kind(), {})
+        for name, value in self._index_entries(key, entity):
+            kind_index.setdefault(name, {}).setdefault(value, set()).add(key)
+
+    def _remove(self, key, unlist=True):
+        entity = self._entities.pop(key, None)
+        if entity is None:
+            return False
+        if unlist:
+            paths = self._by_kind[key.kind()]
+            del paths[bisect.bisect_left(paths, key._path)]
+        kind_index = self._indexes.get(key.kind(), {})
+        for name, value in self._index_entries(key, entity):
+            kind_index[name][value].discard(key)
+            if not kind_index[name][value]:
+                del kind_index[name][value]
+        return True
+
+    def get(self, keys):
+        self._open()
+        return [self._entities.get(key) for key in keys]
+
+    def put(self, items):
+        with self._lock:
+            self._open()
+            for key, entity in items:
+                self._insert(key, entity)
+            if self._sqlite is not None:
+                self._sqlite.executemany(
+                    'INSERT OR REPLACE INTO entities VALUES (?, ?, ?)',
+                    [(str(key), key.kind(), buffer(pickle.dumps(entity, 2)))
+                     for key, entity in items])
+                self._sqlite.commit()
+
+    def delete(self, keys):
+        with self._lock:
+            self._open()
+            removed = [key for key in keys if self._remove(key)]
+            if self._sqlite is not None and removed:
+                self._sqlite.executemany(
+                    'DELETE FROM entities WHERE key = ?',
+                    [(str(key),) for key in removed])
+                self._sqlite.commit()
+
+    def keys_for_kind(self, kind):
+        self._open()
+        return set(Key._from_path(path) for path in self._by_kind.get(kind, ()))
+
+    def paths_for_kind(self, kind):
+        '''The key paths of kind in order. Callers must not modify it.'''
+        self._open()
+        return self._by_kind.get(kind, [])
+
+    def keys_for_value(self, kind, name, value):
+        self._open()
+        return self._indexes.get(kind, {}).get(name, {}).get(value, set())
+
+    def entity(self, key):
+        return self._entities[key]
+
+    def clear(self):
+        with self._lock:
+            self._open()
+            self._entities.clear()
+            self._by_kind.clear()
+            self._indexes.clear()
+            if self._sqlite is not None:
+                self._sqlite.execute('DELETE FROM entities')
+                self._sqlite.commit()
+
+
+_store = _Store(os.environ.get('STORAGE_LOCAL_PATH'))
+
+
+def reset():
+    '''Drops every stored entity. Handy between benchmark runs.'''
+    _store.clear()
+
+
+def _to_key(value):
+    if isinstance(value, Key):
+        return value
+    if isinstance(value, Model):
+        return value.key()
+    if isinstance(value, basestring):
+        return Key(value)
+    raise BadArgumentError('Expected a key or model, got %r' % (value,))
+
+
+def _load(key, entity):
+    if entity is None:
+        return None
+    return _kind_map[key.kind()]._from_entity(key, entity)
+
+
+def get(keys):
+    multiple = isinstance(keys, (list, tuple))
+    keys = [_to_key(key) for key in (keys if multiple else [keys])]
+    results = [_load(key, entity)
+               for key, entity in zip(keys, _store.get(keys))]
+    return results if multiple else results[0]
+
+
+class _Result(object):
+    '''An already finished RPC, for the *_async functions.'''
+
+    def __init__(self, result):
+        self._result = result
+
+    def get_result(self):
+        return self._result
+
+
+def get_async(keys):
+    return _Result(get(keys))
+
+
+def put(models):
+    multiple = isinstance(models, (list, tuple))
+    models = models if multiple else [models]
+    items = []
+    for model in models:
+        if model._key is None:
+            if model._key_name is None:
+                model._key_name = _store.allocate_id()
+            model._key = Key.from_path(model.kind(), model._key_name,
+                                       parent=model._parent)
+        items.append((model._key, model._to_entity()))
+    _store.put(items)
+    keys = [key for key, unused_entity in items]
+    return keys if multiple else keys[0]
+
+
+def delete(models):
+    multiple = isinstance(models, (list, tuple))
+    _store.delete([_to_key(model) for model in
+                   (models if multiple else [models])])
+
+
+class _Descending(object):
+    '''Wraps a value so that it sorts in reverse.'''
+
+    def __init__(self, value):
+        self.value = value
+
+    def __cmp__(self, other):
+        return cmp(other.value, self.value)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'datetime': [value.year, value.month, value.day, value.hour,
+                             value.minute, value.second, value.microsecond]}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and 'datetime' in value:
+        return datetime.datetime(*value['datetime'])
+    return value
+
+
+class Query(object):
+    '''
+    Supports equality filters, ancestor filters, sort orders, offsets and
+    cursors. Like the datastore's, cursors hold the position of the last
+    result returned (its sort order values and key) rather than a count, so
+    resuming from one skips or repeats nothing when entities are written in
+    between.
+    '''
+
+    def __init__(self, model_class, keys_only=False):
+        self._model_class = model_class
+        self._keys_only = keys_only
+        self._filters = []
+        self._orders = []
+        self._ancestor = None
+        self._start = None
+        self._end = None
+        self._last = None
+
+    def filter(self, property_operator, value):
+        parts = property_operator.split()
+        if len(parts) == 2 and parts[1] == '=' or len(parts) == 1:
+            self._filters.append((parts[0], value))
+        else:
+            raise BadArgumentError('Only equality filters are supported, '
+                                   'got %r' % property_operator)
+        return self
+
+    def order(self, property):
+        if property.startswith('-'):
+            self._orders.append((property[1:], True))
+        else:
+            self._orders.append((property, False))
+        return self
+
+    def ancestor(self, ancestor):
+        self._ancestor = _to_key(ancestor)
+        return self
+
+    def with_cursor(self, start_cursor=None, end_cursor=None):
+        # Decoded by fetch, as what a cursor holds depends on the orders.
+        if start_cursor:
+            self._start = start_cursor
+        if end_cursor:
+            self._end = end_cursor
+        return self
+
+    def cursor(self):
+        position = self._last
+        if position is not None and self._orders:
+            position = [_encode_value(getattr(value, 'value', value))
+                        for value in position[:-1]] + [position[-1]]
+        return base64.urlsafe_b64encode(json.dumps(position))
+
+    def _decode_cursor(self, cursor):
+        try:
+            position = json.loads(base64.urlsafe_b64decode(str(cursor)))
+        except (TypeError, ValueError):
+            raise BadArgumentError('Invalid cursor %r' % cursor)
+        if position is None:
+            return None
+        try:
+            if not self._orders:
+                return tuple(tuple(pair) for pair in position)
+            values = [_decode_value(value) for value in position[:-1]]
+            if len(values) != len(self._orders):
+                raise ValueError
+            return tuple(
+                _Descending(value) if descending else value
+                for value, (unused_name, descending)
+                in zip(values, self._orders)) + (
+                    tuple(tuple(pair) for pair in position[-1]),)
+        except (TypeError, ValueError):
+            raise BadArgumentError('Invalid cursor %r' % cursor)
+
+    def _position(self, key):
+        # Where key's entity sorts in the results: its order values, then
+        # its key path, which breaks ties.
+        entity = _store.entity(key)
+        return tuple(
+            _Descending(entity.get(name)) if descending else entity.get(name)
+            for name, descending in self._orders) + (key._path,)
+
+    def _positions(self):
+        '''The positions of the matching entities, in order.'''
+        kind = self._model_class.kind()
+        if not self._filters and not self._orders:
+            # Straight off the kind's ordered key paths, where an ancestor's
+            # descendants are contiguous.
+            paths = _store.paths_for_kind(kind)
+            if self._ancestor is None:
+                return paths
+            ancestor = self._ancestor._path
+            start = end = bisect.bisect_left(paths, ancestor)
+            while (end < len(paths) and
+                   paths[end][:len(ancestor)] == ancestor):
+                end += 1
+            return paths[start:end]
+        if self._filters:
+            # Smallest posting set first keeps the intersections cheap.
+            sets = sorted((_store.keys_for_value(kind, name, value)
+                           for name, value in self._filters), key=len)
+            keys = set(sets[0])
+            for other in sets[1:]:
+                keys.intersection_update(other)
+                if not keys:
+                    break
+        else:
+            keys = _store.keys_for_kind(kind)
+        if self._ancestor is not None:
+            keys = [key for key in keys if key.has_ancestor(self._ancestor)]
+        if not self._orders:
+            return sorted(key._path for key in keys)
+        return sorted(self._position(key) for key in keys)
+
+    def fetch(self, limit, offset=0):
+        positions = self._positions()
+        start_position = end_position = None
+        if self._start is not None:
+            start_position = self._decode_cursor(self._start)
+        if self._end is not None:
+            end_position = self._decode_cursor(self._end)
+        start = 0
+        if start_position is not None:
+            start = bisect.bisect_right(positions, start_position)
+        start = min(start + offset, len(positions))
+        end = len(positions) if limit is None else start + limit
+        if end_position is not None:
+            end = min(end, bisect.bisect_right(positions, end_position))
+        page = positions[start:end]
+        if page:
+            self._last = page[-1]
+        elif start:
+            self._last = positions[start - 1]
+        else:
+            self._last = start_position
+        if self._orders:
+            keys = [Key._from_path(position[-1]) for position in page]
+        else:
+            keys = [Key._from_path(path) for path in page]
+        if self._keys_only:
+            return keys
+        return [_load(key, _store.entity(key)) for key in keys]
+
+    def run(self, limit=None, offset=0, **kwargs):
+        # kwargs such as batch_size only tune the real datastore's RPCs.
+        return iter(self.fetch(limit, offset=offset))
+
+    __iter__ = run
+
+    def get(self):
+        results = self.fetch(1)
+        return results[0] if results else None
+
+    def count(self, limit=None):
+        return len(self.fetch(limit))
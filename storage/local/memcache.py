@@ -0,0 +1,76 @@
+'''
+Stand-in for google.appengine.api.memcache.
+
+Values are pickled on the way in, as the real client does, so callers never
+share mutable values through the cache. Entries expire after `time` seconds
+if it is given; nothing is evicted for space.
+'''
+
+import cPickle as pickle
+import threading
+import time as _time
+
+_lock = threading.Lock()
+# key -> (pickled value, expiry timestamp or None)
+_cache = {}
+
+
+def _live(key):
+    entry = _cache.get(key)
+    if entry is not None and entry[1] is not None and entry[1] <= _time.time():
+        del _cache[key]
+        return None
+    return entry
+
+
+def _expiry(time):
+    return _time.time() + time if time else None
+
+
+def get(key):
+    with _lock:
+        entry = _live(key)
+    if entry is None:
+        return None
+    return pickle.loads(entry[0])
+
+
+def set(key, value, time=0):
+    with _lock:
+        _cache[key] = (pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                       _expiry(time))
+    return True
+
+
+def add(key, value, time=0):
+    with _lock:
+        if _live(key) is not None:
+            return False
+        _cache[key] = (pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                       _expiry(time))
+    return True
+
+
+def delete(key):
+    with _lock:
+        return 2 if _cache.pop(key, None) is not None else 1
+
+
+def incr(key, delta=1, initial_value=None):
+    with _lock:
+        entry = _live(key)
+        if entry is None:
+            if initial_value is None:
+                return None
+            value, expiry = initial_value, None
+        else:
+            value, expiry = pickle.loads(entry[0]), entry[1]
+        value += delta
+        _cache[key] = (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expiry)
+    return value
+
+
+def flush_all():
+    with _lock:
+        _cache.clear()
+    return True
@@ -0,0 +1,28 @@
+'''
+Stand-in for google.appengine.api.taskqueue.
+
+Tasks are not run; they are appended to `tasks` so a local driver can decide
+whether and when to replay them against the app.
+'''
+
+tasks = []
+
+
+class Task(object):
+    def __init__(self, url, params=None, method='POST', queue_name='default',
+                 **kwargs):
+        self.url = url
+        self.params = params or {}
+        self.method = method
+        self.queue_name = queue_name
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return '<Task %s %s>' % (self.method, self.url)
+
+
+def add(url, params=None, method='POST', queue_name='default', **kwargs):
+    task = Task(url, params=params, method=method, queue_name=queue_name,
+                **kwargs)
+    tasks.append(task)
+    return task
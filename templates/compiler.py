@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+'''
+Precompiles the Mako templates into Python modules shipped with the app.
+
+Without them every new instance lexes, parses and generates code for each
+template the first time it renders it. Run this before deploying, from the
+top of the app:
+
+  python -m templates.compiler [--force]
+
+The modules land in the templates.compiled package, one per template, and
+PrecompiledTemplateLookup loads them with a plain import (so App Engine's
+python_precompiled step covers them too). A template with no module, or a
+module older than the template, is compiled in memory as before.
+'''
+
+import logging
+import optparse
+import os
+import re
+import stat
+import sys
+
+from mako import exceptions
+from mako.lookup import TemplateLookup
+from mako.template import ModuleTemplate, Template
+
+DEFAULT_PACKAGE = 'templates.compiled'
+
+TEMPLATE_SUFFIX = '.mako.html'
+
+
+def module_name(uri):
+  '''Name of the compiled module for the template at uri.'''
+  return re.sub(r'\W', '_', uri.lstrip('/'))
+
+
+def _source_path(module):
+  path = module.__file__
+  if path.endswith(('.pyc', '.pyo')) and os.path.exists(path[:-1]):
+    path = path[:-1]
+  return path
+
+
+def _mtime(path):
+  return os.stat(path)[stat.ST_MTIME]
+
+
+class PrecompiledTemplateLookup(TemplateLookup):
+  '''
+  A TemplateLookup that prefers modules written by compile_all().
+  '''
+
+  def __init__(self, *args, **kwargs):
+    self.module_package = kwargs.pop('module_package', DEFAULT_PACKAGE)
+    TemplateLookup.__init__(self, *args, **kwargs)
+
+  @property
+  def package_directory(self):
+    return os.path.join(*self.module_package.split('.'))
+
+  def _load(self, filename, uri):
+    template = self._load_compiled(filename, uri)
+    if template is None:
+      return TemplateLookup._load(self, filename, uri)
+    self._collection[uri] = template
+    return template
+
+  def _load_compiled(self, filename, uri):
+    name = '%s.%s' % (self.module_package, module_name(uri))
+    try:
+      __import__(name)
+    except ImportError:
+      return None
+    module = sys.modules[name]
+    module_filename = _source_path(module)
+    if _mtime(module_filename) < _mtime(filename):
+      logging.info('Compiled template %s is stale, compiling in memory', uri)
+      return None
+    args = self.template_args
+    return ModuleTemplate(module,
+                          module_filename=module_filename,
+                          template_filename=filename,
+                          output_encoding=args['output_encoding'],
+                          encoding_errors=args['encoding_errors'],
+                          disable_unicode=args['disable_unicode'],
+                          format_exceptions=args['format_exceptions'],
+                          error_handler=args['error_handler'],
+                          lookup=self,
+                          cache_type=args['cache_type'],
+                          cache_dir=args['cache_dir'],
+                          cache_url=args['cache_url'],
+                          cache_enabled=args['cache_enabled'])
+
+  def _check(self, uri, template):
+    # Mako compares the template against the time its module was generated,
+    # which means nothing once the module has been deployed; compare the
+    # files instead.
+    path = getattr(template.module, '__file__', None)
+    if path is None or template.filename is None:
+      return TemplateLookup._check(self, uri, template)
+    if not os.path.exists(template.filename):
+      self._collection.pop(uri, None)
+      raise exceptions.TemplateLookupException(
+        'Cant locate template for uri %r' % uri)
+    if _mtime(_source_path(template.module)) < _mtime(template.filename):
+      self._collection.pop(uri, None)
+      return self._load(template.filename, uri)
+    return template
+
+  def iter_templates(self):
+    '''Yields (uri, filename) for every template under the directories.'''
+    for directory in self.directories:
+      for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for basename in sorted(files):
+          if not basename.endswith(TEMPLATE_SUFFIX):
+            continue
+          filename = os.path.join(root, basename)
+          yield '/' + os.path.relpath(filename, directory), filename
+
+  def preload(self):
+    '''
+    Loads every template under the directories, so that with
+    filesystem_checks off no request touches the filesystem. Returns the
+    uris loaded.
+    '''
+    uris = []
+    for uri, unused_filename in self.iter_templates():
+      self.get_template(uri)
+      uris.append(uri)
+    return uris
+
+  def reload(self):
+    '''Forgets every loaded template, so the next lookup reads it afresh.'''
+    self._mutex.acquire()
+    try:
+      self._collection.clear()
+      self._uri_cache.clear()
+      prefix = self.module_package + '.'
+      for name in [name for name in sys.modules if name.startswith(prefix)]:
+        del sys.modules[name]
+    finally:
+      self._mutex.release()
+
+  def compile_all(self, force=False):
+    '''
+    Writes a module for every template, skipping those whose module is newer
+    than the template unless force is set. Returns the uris compiled.
+    '''
+    directory = self.package_directory
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    init = os.path.join(directory, '__init__.py')
+    if not os.path.exists(init):
+      open(init, 'w').write('# generated by templates.compiler.\n')
+
+    compiled = []
+    for uri, filename in self.iter_templates():
+      path = os.path.join(directory, module_name(uri) + '.py')
+      if force and os.path.exists(path):
+        os.remove(path)
+      if os.path.exists(path) and _mtime(path) >= _mtime(filename):
+        continue
+      # Template writes the module when it is missing or older than the
+      # template, with the lookup's filters and imports baked in.
+      Template(uri=uri, filename=filename, lookup=self,
+               module_filename=os.path.abspath(path), **self.template_args)
+      compiled.append(uri)
+    return compiled
+
+
+def main(argv):
+  parser = optparse.OptionParser(usage='%prog [--force]')
+  parser.add_option('--force', action='store_true', default=False,
+                    help='recompile templates that look up to date')
+  options, unused_args = parser.parse_args(argv[1:])
+
+  # Compile with exactly the options the app renders with.
+  import main as app
+  lookup = app.BaseHandler.renderer_.lookup
+  compiled = lookup.compile_all(force=options.force)
+  sys.stdout.write('Compiled %d templates into %s\n' % (
+    len(compiled), lookup.package_directory))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+'''
+Imports records into the local datastore stand-in and renders the pages that
+list the games. Run from the top of the app:
+
+  python -m unittest tests.test_importer
+'''
+
+import os
+import unittest
+
+os.environ.setdefault('STORAGE_BACKEND', 'local')
+
+import webapp2
+
+import importer
+import main
+import models
+from storage import db
+from storage import memcache
+
+
+def get(url):
+  return webapp2.Request.blank(url).get_response(main.app)
+
+
+class MergeBatchTest(unittest.TestCase):
+
+  def setUp(self):
+    db.reset()
+    memcache.flush_all()
+
+  def test_new_game_without_prices_is_skipped(self):
+    written = importer.merge_batch({'10': (u'Name Only', [])})
+    self.assertEqual(0, written)
+    self.assertEqual(None, models.SteamGame.get_by_key_name('10'))
+    self.assertEqual(200, get('/').status_int)
+    self.assertEqual(404, get('/games/10').status_int)
+
+  def test_new_game_with_prices_renders(self):
+    importer.merge_batch({'10': (u'Name Only', []),
+                          '20': (u'Priced', [[1300000000, 9.99]])})
+    game_model = models.SteamGame.get_by_key_name('20')
+    self.assertEqual(9.99, game_model.current_price)
+    for url in ('/', '/games/20'):
+      response = get(url)
+      self.assertEqual(200, response.status_int)
+      self.assertTrue('Priced' in response.body)
+      self.assertFalse('Name Only' in response.body)
+
+  def test_existing_game_without_prices_is_left_alone(self):
+    importer.merge_batch({'20': (u'Priced', [[1300000000, 9.99]])})
+    self.assertEqual(0, importer.merge_batch({'20': (u'Priced', [])}))
+    self.assertEqual(200, get('/games/20').status_int)
+
+
+if __name__ == '__main__':
+  unittest.main()